@@ -3,21 +3,25 @@ from falcon import falcon
 ### This script represents the prototype of the potential Falcon functionality in Zcash's "Sprout" protocol ###
 ###############################################################################################################
 
+# Variable which determines the employed XOF-Hashing-Algorithm (see falcon.XOFS) - utilized for benchmarking by "test_compare_*.py"
+default_xof = "KangarooTwelve"
+
 # Wrapper class for a public key object
 class PublicKey:
     def __init__(self, secret_key):
-        self.privkey = secret_key.key
         self.pubkey = secret_key.key.h
+        # Only the encoding of h is handed over, the secret key is not needed for verification
+        self.key = falcon.PublicKey(secret_key.key.n, secret_key.key.encode_public_key(), secret_key.key.xof)
 
     # Verification of an Falcon signature
     def verify(self, message, signature):
-        result = self.privkey.verify(message, signature)
+        result = self.key.verify(message, signature)
         return result
 
 # Wrapper class for a private key object
 class PrivateKey:
     def __init__(self, n, polys=None):
-        self.key = falcon.SecretKey(n, polys)
+        self.key = falcon.SecretKey(n, polys, default_xof)
 
     # Creation of a Falcon signature on a message
     def sign(self, message):
@@ -4,26 +4,30 @@ from falcon import falcon
 ### This script represents the prototype of the potential Falcon functionality in Zcash's "Transparent" protocol ###
 ####################################################################################################################
 
+# Variable which determines the employed XOF-Hashing-Algorithm (see falcon.XOFS) - utilized for benchmarking by "test_compare_*.py"
+default_xof = "KangarooTwelve"
+
 # Wrapper class for a public key object
 class PublicKey:
     def __init__(self, secret_key):
         self.pubkey = secret_key.key.h
-        self.privkey = secret_key.key
+        # Only the encoding of h is handed over, the secret key is not needed for verification
+        self.key = falcon.PublicKey(secret_key.key.n, secret_key.key.encode_public_key(), secret_key.key.xof)
 
     # Verification of a Falcon signature
     def verify(self, message, signature):
-        result = self.privkey.verify(message, signature)
+        result = self.key.verify(message, signature)
         return result
 
     # Verification of a Falcon signature in public-key recovery mode
     def verify_recoverable(self, message, signature):
-        result = self.privkey.verify_recoverable(message, signature)
+        result = self.key.verify_recoverable(message, signature)
         return result
 
 # Wrapper class for a private key object
 class PrivateKey:
     def __init__(self, n, polys=None):
-        self.key = falcon.SecretKey(n, polys)
+        self.key = falcon.SecretKey(n, polys, default_xof)
 
     # Creation of a Falcon signature on a message
     def sign(self, message):
@@ -40,6 +44,21 @@ class PrivateKey:
         publickey = self.key.recover(message, signature)
         return publickey
 
+# Recovery of a public key from a Falcon signature - only the parameter set is needed, no key object
+def recover(n, message, signature):
+    publickey = falcon.recover(n, message, signature, default_xof)
+    return publickey
+
+# Verification of a Falcon signature in public-key recovery mode - only the parameter set is needed, no key object
+def verify_recoverable(n, message, signature):
+    result = falcon.verify_recoverable(n, message, signature, default_xof)
+    return result
+
+# Verification of a Falcon signature in public-key recovery mode, whose recovered public key must have the fingerprint expected_key_hash
+def verify_and_recover(n, message, signature, expected_key_hash):
+    result = falcon.verify_and_recover(n, message, signature, expected_key_hash, default_xof)
+    return result
+
 # Generation of a Falcon public and private key pair
 def generateKeyPair(n, polys=None):
     private = PrivateKey(n, polys)
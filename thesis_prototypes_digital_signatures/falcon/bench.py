@@ -0,0 +1,710 @@
+"""
+This file implements benchmarks for various parts of the Falcon.py library.
+
+Run the benchmarks with:
+> make bench
+"""
+from falcon.falcon import SecretKey, PublicKey, verify_batch_multikey, XOFS
+from falcon.falcon import Params, SALT_LEN, HEAD_LEN, param_context, COMPACT_HEADER, logn
+from falcon.encoding import compress, decompress, compress_compact
+from falcon.samplerz import samplerz, samplerz_batch
+from falcon.ntrugen import ntru_gen, ntru_solve, gen_poly, SIGMA_FG, NtruGenStats
+from falcon.ntrugen import karatsuba
+from falcon import ntrugen
+from falcon.keygen import KeygenPool
+from falcon.rng import EntropyPool, ChaCha20, FastChaCha20
+from falcon.ffsampling import ffldl_fft, ffsampling_fft, ffldl_flat, ffsampling_flat
+from falcon.falcon import normalize_tree
+from Crypto.Hash import SHAKE256
+from falcon.fft import fft, fft_batch, ifft_batch
+from falcon.ntt import ntt, intt, mul_zq, ntt_batch, intt_batch
+from falcon.ntt_constants import inv_mod_q
+from falcon.test import fft_ref, ifft_ref, ntt_ref, intt_ref
+from random import randint
+from falcon.common import q
+from numpy import sqrt
+from falcon.keystore import save_keys, load_keys
+from tempfile import TemporaryDirectory
+from os import path, remove, urandom
+import tracemalloc
+from falcon.scripts.sign_KAT import sign_KAT
+# https://stackoverflow.com/a/25823885/4143624
+from timeit import default_timer as timer
+
+
+def kat_secret_key(n, index=0, xof=None):
+    """Return the secret key of the index-th signature test vector for n."""
+    D = sign_KAT[n][index]
+    return SecretKey(n, [D["f"], D["g"], D["F"], D["G"]], xof)
+
+
+def report(name, diff, count, unit):
+    """
+    Print the running time of a benchmark, given the total time diff
+    spent on count items, as a time per item.
+    """
+    usec = round(diff * 1000000 / count, 1)
+    message = "Bench {name}".format(name=name)
+    message = message.ljust(40) + ": "
+    message += "{usec} usec / {unit}".format(usec=usec, unit=unit).rjust(28)
+    print(message)
+
+
+def report_ratio(name, diff_ref, diff):
+    """Print the speedup of a benchmark, given the time of its reference diff_ref."""
+    message = "Bench {name}".format(name=name)
+    message = message.ljust(40) + ": "
+    message += "x {ratio}".format(ratio=round(diff_ref / diff, 1)).rjust(28)
+    print(message)
+
+
+def bench_transforms(name, n, iterations, nb_fft, nb_ntt):
+    """
+    Report the cost of the transforms of an operation: nb_fft[0] FFTs and
+    nb_fft[1] inverse FFTs, nb_ntt[0] NTTs and nb_ntt[1] inverse NTTs, each
+    group in one batched call, against the reference recursive transforms
+    of falcon.test (the scalar engine that fft_batch and ntt_batch replaced),
+    and the speedup.
+    """
+    f = [[randint(-100, 100) for j in range(n)] for k in range(max(nb_fft + nb_ntt))]
+    f_ntt = [[randint(0, q - 1) for j in range(n)] for k in range(nb_ntt[1])]
+    # The reference inverse FFT takes all the n FFT coefficients
+    groups = [(fft_batch, fft_ref, f[:nb_fft[0]], f[:nb_fft[0]]),
+              (ifft_batch, ifft_ref, fft_batch(f[:nb_fft[1]]), [fft_ref(poly) for poly in f[:nb_fft[1]]]),
+              (ntt_batch, ntt_ref, f[:nb_ntt[0]], f[:nb_ntt[0]]),
+              (intt_batch, intt_ref, f_ntt, f_ntt)]
+    groups = [group for group in groups if len(group[3]) > 0]
+
+    start = timer()
+    for i in range(iterations):
+        for (transform, transform_ref, batch, polys) in groups:
+            transform(batch)
+    end = timer()
+    diff = end - start
+    report("transforms of {name}, n = {n}".format(name=name, n=n), diff, iterations, name)
+
+    start = timer()
+    for i in range(iterations):
+        for (transform, transform_ref, batch, polys) in groups:
+            [transform_ref(poly) for poly in polys]
+    end = timer()
+    diff_ref = end - start
+    report("reference transforms, n = {n}".format(n=n), diff_ref, iterations, name)
+    report_ratio("speedup, n = {n}".format(n=n), diff_ref, diff)
+
+
+def bench_keygen(n, iterations):
+    """
+    Report the latency of key generation (including key expansion),
+    and the cost of its transforms: 4 FFTs for B0, 3 NTTs and 1 inverse
+    NTT for h and its NTT.
+    """
+    start = timer()
+    for i in range(iterations):
+        SecretKey(n).expand()
+    end = timer()
+    report("keygen, n = {n}".format(n=n), end - start, iterations, "key")
+    bench_transforms("key", n, 100, [4, 0], [3, 1])
+
+
+def karatsuba_mul(a, b):
+    """
+    The previous karamul: Karatsuba multiplication, followed by
+    reduction mod (x ** n + 1).
+    """
+    n = len(a)
+    ab = karatsuba(a, b, n)
+    return [ab[i] - ab[i + n] for i in range(n)]
+
+
+def bench_ntrugen(n, iterations):
+    """
+    Report the latency of ntru_solve on the f, g of a test vector, with
+    karamul performed by Kronecker substitution (kronecker_mul) and by
+    Karatsuba (karatsuba_mul), the speedup, and the latency of ntru_gen
+    (whose number of trials varies).
+    """
+    D = sign_KAT[n][0]
+    start = timer()
+    for i in range(iterations):
+        ntru_solve(D["f"], D["g"])
+    end = timer()
+    diff = end - start
+    report("ntru_solve, n = {n}".format(n=n), diff, iterations, "solve")
+    # ntru_solve looks karamul up in falcon.ntrugen on each call
+    karamul = ntrugen.karamul
+    ntrugen.karamul = karatsuba_mul
+    try:
+        start = timer()
+        for i in range(iterations):
+            ntru_solve(D["f"], D["g"])
+        end = timer()
+    finally:
+        ntrugen.karamul = karamul
+    report("ntru_solve with Karatsuba", end - start, iterations, "solve")
+    report_ratio("speedup, n = {n}".format(n=n), end - start, diff)
+    start = timer()
+    for i in range(iterations):
+        ntru_gen(n)
+    end = timer()
+    report("ntru_gen, n = {n}".format(n=n), end - start, iterations, "key")
+
+
+def bench_ntrugen_stats(n, count):
+    """
+    Report the counters of ntru_gen over count keys: candidates,
+    rejections and time of each stage.
+    """
+    stats = NtruGenStats()
+    for i in range(count):
+        ntru_gen(n, stats=stats)
+    print("Bench ntru_gen stages, n = {n}".format(n=n).ljust(40) + ": " + "{count} keys".format(count=count).rjust(28))
+    print(stats)
+
+
+def bench_gen_poly(n, iterations):
+    """
+    Compare gen_poly (table-driven) against the samplerz-based
+    reference: sums of samples of samplerz_batch.
+    """
+    k = 4096 // n
+    start = timer()
+    for i in range(iterations):
+        samplerz_batch([0] * 4096, SIGMA_FG, SIGMA_FG - 0.001).reshape(n, k).sum(axis=1).tolist()
+    end = timer()
+    report("samplerz_batch sums, n = {n}".format(n=n), end - start, iterations, "poly")
+    start = timer()
+    for i in range(iterations):
+        gen_poly(n)
+    end = timer()
+    report("gen_poly, n = {n}".format(n=n), end - start, iterations, "poly")
+
+
+def bench_keygen_pool(n, iterations, count, workers=None):
+    """
+    Compare ntru_gen against a KeygenPool: the latency distribution of
+    single keys (speculative generation), then the throughput of
+    generating count keys (bulk generation).
+    """
+    with KeygenPool(workers) as pool:
+        # Start the processes before timing anything
+        pool.ntru_gen_bulk(n, pool.workers)
+        for (name, keygen) in [("ntru_gen", ntru_gen), ("KeygenPool.ntru_gen", pool.ntru_gen)]:
+            latencies = []
+            for i in range(iterations):
+                start = timer()
+                keygen(n)
+                latencies += [timer() - start]
+            latencies.sort()
+            message = "Bench {name}, n = {n}".format(name=name, n=n).ljust(40) + ": "
+            for (label, value) in [("min", latencies[0]), ("median", latencies[iterations // 2]),
+                                   ("p90", latencies[(9 * iterations) // 10]), ("max", latencies[-1])]:
+                message += "{label} {ms} ms".format(label=label, ms=round(value * 1000)).rjust(16)
+            print(message)
+        print("({workers} workers)".format(workers=pool.workers).rjust(66))
+
+        start = timer()
+        for i in range(count):
+            ntru_gen(n)
+        end = timer()
+        print("Bench ntru_gen, {count} keys".format(count=count).ljust(40) + ": " + "{rate} keys / sec".format(rate=round(count / (end - start), 2)).rjust(28))
+        start = timer()
+        pool.ntru_gen_bulk(n, count)
+        end = timer()
+        print("Bench ntru_gen_bulk, {count} keys".format(count=count).ljust(40) + ": " + "{rate} keys / sec".format(rate=round(count / (end - start), 2)).rjust(28))
+
+
+def bench_expand(n, iterations):
+    """
+    Report the latency of the construction of a key, SecretKey(n, [f, g, F, G]),
+    which is lazy, then of its expansion by expand.
+    """
+    D = sign_KAT[n][0]
+    keys = []
+    start = timer()
+    for i in range(iterations):
+        keys += [SecretKey(n, [D["f"], D["g"], D["F"], D["G"]])]
+    end = timer()
+    report("key construction, n = {n}".format(n=n), end - start, iterations, "key")
+    start = timer()
+    for sk in keys:
+        sk.expand()
+    end = timer()
+    report("key expansion, n = {n}".format(n=n), end - start, iterations, "key")
+
+
+def bench_tree(n, iterations):
+    """
+    Compare the nested ffLDL tree (ffldl_fft, ffsampling_fft) against
+    the flattened one (ffldl_flat, ffsampling_flat): memory measured with
+    tracemalloc, and latency of the sampling, with its randomness.
+    """
+    sk = kat_secret_key(n)
+    G0_fft = (sk.B0_fft[:, None] * sk.B0_fft[None, :].conjugate()).sum(axis=2)
+    t_fft = sk.preimage_target(sk.hash_to_point(b"message", bytes(40)))
+    seed = bytes(56)
+
+    tracemalloc.start()
+    T_fft = ffldl_fft(G0_fft.tolist())
+    normalize_tree(T_fft, sk.sigma)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("Bench nested tree, n = {n}".format(n=n).ljust(40) + ": " + "{kib} KiB".format(kib=round(size / 1024, 1)).rjust(28))
+
+    tracemalloc.start()
+    T_flat = ffldl_flat(G0_fft)
+    T_flat[1] = sk.sigma / sqrt(T_flat[1])
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("Bench flat tree, n = {n}".format(n=n).ljust(40) + ": " + "{kib} KiB".format(kib=round(size / 1024, 1)).rjust(28))
+
+    tracemalloc.start()
+    key = kat_secret_key(n)
+    key.expand()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("Bench secret key, n = {n}".format(n=n).ljust(40) + ": " + "{kib} KiB".format(kib=round(size / 1024, 1)).rjust(28))
+
+    for (name, sampling, T) in [("ffsampling_fft", ffsampling_fft, T_fft), ("ffsampling_flat", ffsampling_flat, T_flat)]:
+        start = timer()
+        for i in range(iterations):
+            sampling(t_fft, T, sk.sigmin, FastChaCha20(seed).randombytes)
+        end = timer()
+        report("{name}, n = {n}".format(name=name, n=n), end - start, iterations, "sampling")
+
+
+def bench_keystore(n, counts):
+    """
+    For each count of keys, compare the cold construction of the keys
+    (key expansion from f, g, F, G) against loading them from a key file.
+    The keys cycle through the test vectors. All the keys of a count are
+    expanded in memory at once (about 0.25 MB per key at n = 512, with a key
+    file of about 70 KB per key), so counts should stay around 1000 or less.
+    """
+    vectors = [[D["f"], D["g"], D["F"], D["G"]] for D in sign_KAT[n]]
+    with TemporaryDirectory() as directory:
+        filename = path.join(directory, "keys")
+        for count in counts:
+            start = timer()
+            keys = [SecretKey(n, vectors[i % len(vectors)]) for i in range(count)]
+            for sk in keys:
+                sk.expand()
+            end = timer()
+            report("cold construction, {count} keys".format(count=count), end - start, count, "key")
+
+            try:
+                save_keys(filename, keys)
+                del keys
+                start = timer()
+                keys = load_keys(filename)
+                end = timer()
+                report("load from disk, {count} keys".format(count=count), end - start, count, "key")
+                del keys
+            finally:
+                if path.exists(filename):
+                    remove(filename)
+
+
+def bench_sign(n, iterations):
+    """
+    Report the latency of signing, and the cost of the transforms of a
+    signing attempt: 1 FFT for the target, 2 inverse FFTs for v.
+    """
+    sk = kat_secret_key(n)
+    start = timer()
+    for i in range(iterations):
+        sk.sign(b"message")
+    end = timer()
+    report("sign, n = {n}".format(n=n), end - start, iterations, "signature")
+    bench_transforms("attempt", n, 100, [1, 2], [0, 0])
+
+
+def bench_preimage_target(n, iterations):
+    """
+    Report the cost of the target of sample_preimage: computed per message
+    with preimage_target, against the scalar computation from B0_fft used
+    before (as lists, per coefficient), and the cost of a signing attempt
+    with the target precomputed or recomputed.
+    """
+    sk = kat_secret_key(n)
+    sk.expand()
+    points = [sk.hash_to_point(i.to_bytes(4, "little"), bytes(SALT_LEN)) for i in range(iterations)]
+
+    start = timer()
+    for point in points:
+        sk.preimage_target(point)
+    end = timer()
+    report("preimage_target, n = {n}".format(n=n), end - start, iterations, "target")
+
+    b = sk.B0_fft[0][1].tolist()
+    d = sk.B0_fft[1][1].tolist()
+    start = timer()
+    for point in points:
+        point_fft = fft(point)
+        t0_fft = [(point_fft[i] * d[i]) / q for i in range(len(point_fft))]
+        t1_fft = [(-point_fft[i] * b[i]) / q for i in range(len(point_fft))]
+    end = timer()
+    report("scalar target, n = {n}".format(n=n), end - start, iterations, "target")
+
+    targets = [sk.preimage_target(point) for point in points]
+    start = timer()
+    for (point, t_fft) in zip(points, targets):
+        sk.sample_preimage(point, t_fft=t_fft)
+    end = timer()
+    report("attempt, given target, n = {n}".format(n=n), end - start, iterations, "attempt")
+    start = timer()
+    for point in points:
+        sk.sample_preimage(point)
+    end = timer()
+    report("attempt, no target, n = {n}".format(n=n), end - start, iterations, "attempt")
+
+
+def sign_recoverable_ref(sk, message):
+    """
+    Sign a message in public key recovery mode as sign_recoverable did
+    before checking s2 from its NTT: s2 is inverted through the NTT and
+    multiplied back, and this check runs before the norm check.
+    """
+    neutral_polynomial = [1] + [0] * (sk.n - 1)
+    header = (0x30 + logn[sk.n]).to_bytes(1, "little")
+    salt = urandom(SALT_LEN)
+    hashed = sk.hash_to_point(message, salt)
+    t_fft = sk.preimage_target(hashed)
+    while (1):
+        s = sk.sample_preimage(hashed, t_fft=t_fft)
+        inv_s2 = intt([inv_mod_q[coef] for coef in ntt(s[1])])
+        if not mul_zq(s[1], inv_s2) == neutral_polynomial:
+            continue
+        norm_sign = sum(coef ** 2 for coef in s[0]) + sum(coef ** 2 for coef in s[1])
+        if norm_sign <= sk.signature_bound:
+            enc_s1 = compress(s[0], sk.sig_bytelen - HEAD_LEN - SALT_LEN)
+            enc_s2 = compress(s[1], sk.sig_bytelen - HEAD_LEN - SALT_LEN)
+            if enc_s1 is not False and enc_s2 is not False:
+                return header + salt + enc_s1 + enc_s2
+
+
+def bench_sign_recoverable(n, iterations):
+    """
+    Report the latency of signing in public key recovery mode, against the
+    previous invertibility check of s2 (see sign_recoverable_ref), per
+    signature and for the check alone, and the speedups.
+    """
+    sk = kat_secret_key(n)
+    s2 = sk.split_and_decompress_signature(sk.sign_recoverable(b"message"))[2]
+
+    timings = []
+    for (name, check) in [
+            ("s2 check, n = {n}".format(n=n), lambda: any((coef == 0) for coef in ntt(s2))),
+            ("reference s2 check", lambda: mul_zq(s2, intt([inv_mod_q[coef] for coef in ntt(s2)])))]:
+        start = timer()
+        for i in range(iterations):
+            check()
+        end = timer()
+        timings += [end - start]
+        report(name, end - start, iterations, "check")
+    report_ratio("speedup of the check, n = {n}".format(n=n), timings[1], timings[0])
+
+    timings = []
+    for (name, sign) in [
+            ("sign_recoverable, n = {n}".format(n=n), sk.sign_recoverable),
+            ("reference sign_recoverable", lambda message: sign_recoverable_ref(sk, message))]:
+        start = timer()
+        for i in range(iterations):
+            sign(b"message")
+        end = timer()
+        timings += [end - start]
+        report(name, end - start, iterations, "signature")
+    report_ratio("speedup, n = {n}".format(n=n), timings[1], timings[0])
+
+
+def bench_entropy_pool(n, iterations, buffer_sizes=[0, 4096, 1 << 16]):
+    """
+    Report the latency of signing and the randomness it consumes, for
+    entropy pools of several buffer sizes (0 reads urandom on each call).
+    """
+    sk = kat_secret_key(n)
+    for size in buffer_sizes:
+        pool = EntropyPool(size)
+        start = timer()
+        for i in range(iterations):
+            sk.sign(b"message", pool=pool)
+        end = timer()
+        report("sign, n = {n}, pool of {size} B".format(n=n, size=size), end - start, iterations, "signature")
+        syscalls = round(pool.syscalls / iterations, 1)
+        nbytes = round(pool.nbytes / iterations)
+        print("{syscalls} syscalls, {nbytes} bytes / signature".format(syscalls=syscalls, nbytes=nbytes).rjust(70))
+
+
+def bench_chacha20(n, iterations):
+    """
+    Report the throughput of ChaCha20 and FastChaCha20, and the latency
+    of signing with a seeded source of randomness (as for the KATs).
+    """
+    seed = bytes(56)
+    for prg_class in [ChaCha20, FastChaCha20]:
+        prg = prg_class(seed)
+        start = timer()
+        for i in range(iterations):
+            prg.randombytes(64)
+        end = timer()
+        report("{name} randombytes".format(name=prg_class.__name__), end - start, iterations * 64, "byte")
+    sk = kat_secret_key(n)
+    shake = SHAKE256.new(b"seed")
+    start = timer()
+    for i in range(10):
+        sk.sign(b"message", shake.read)
+    end = timer()
+    report("seeded sign, n = {n}".format(n=n), end - start, 10, "signature")
+
+
+def bench_hash_to_point(n, iterations):
+    """Report the latency of hash_to_point."""
+    pk = PublicKey(n, [0] * n)
+    salt = bytes(40)
+    start = timer()
+    for i in range(iterations):
+        pk.hash_to_point(i.to_bytes(4, "little"), salt)
+    end = timer()
+    report("hash_to_point, n = {n}".format(n=n), end - start, iterations, "hash")
+
+
+def bench_samplerz(nb_samp, iterations):
+    """
+    Compare the cost per sample of samplerz_batch against a loop over
+    samplerz, for nb_samp samples of distinct centers.
+    """
+    mu = [i / nb_samp for i in range(nb_samp)]
+    sigma, sigmin = 1.5, 1.3
+
+    start = timer()
+    for i in range(iterations):
+        [samplerz(elt, sigma, sigmin) for elt in mu]
+    end = timer()
+    report("samplerz (loop)", end - start, iterations * nb_samp, "sample")
+
+    start = timer()
+    for i in range(iterations):
+        samplerz_batch(mu, sigma, sigmin)
+    end = timer()
+    report("samplerz_batch, {k} samples".format(k=nb_samp), end - start, iterations * nb_samp, "sample")
+
+
+def bench_compress(n, iterations):
+    """Report the latency of compress and decompress on signature-like inputs."""
+    sk = kat_secret_key(n)
+    slen = Params[n]["sig_bytelen"] - SALT_LEN - HEAD_LEN
+    encodings = [sk.sign(i.to_bytes(4, "little"))[HEAD_LEN + SALT_LEN:] for i in range(10)]
+    polys = [decompress(enc, slen, n) for enc in encodings]
+
+    start = timer()
+    for i in range(iterations):
+        compress(polys[i % 10], slen)
+    end = timer()
+    report("compress, n = {n}".format(n=n), end - start, iterations, "poly")
+
+    start = timer()
+    for i in range(iterations):
+        decompress(encodings[i % 10], slen, n)
+    end = timer()
+    report("decompress, n = {n}".format(n=n), end - start, iterations, "poly")
+
+
+def bench_xof(n, iterations):
+    """Report the throughput of hash_to_point, sign and verify for each XOF."""
+    salt = bytes(40)
+    for xof in XOFS:
+        sk = kat_secret_key(n, xof=xof)
+        messages = [i.to_bytes(4, "little") for i in range(iterations)]
+        rates = []
+
+        start = timer()
+        for message in messages:
+            sk.hash_to_point(message, salt)
+        rates += [iterations / (timer() - start)]
+
+        start = timer()
+        signatures = [sk.sign(message) for message in messages]
+        rates += [iterations / (timer() - start)]
+
+        start = timer()
+        for i in range(iterations):
+            sk.verify(messages[i], signatures[i])
+        rates += [iterations / (timer() - start)]
+
+        message = "Bench {xof}, n = {n}".format(xof=xof, n=n).ljust(40) + ": "
+        for (op, rate) in zip(["hash", "sign", "verify"], rates):
+            message += "{rate} {op}/s".format(rate=round(rate), op=op).rjust(16)
+        print(message)
+
+
+def bench_verify_batch(n, iterations):
+    """
+    Compare the amortized cost per signature of verify_batch
+    against a loop over verify, for a single public key.
+    """
+    sk = kat_secret_key(n)
+    pk = PublicKey(n, sk.h)
+    messages = [i.to_bytes(4, "little") for i in range(iterations)]
+    signatures = [sk.sign(message) for message in messages]
+
+    start = timer()
+    for i in range(iterations):
+        pk.verify(messages[i], signatures[i])
+    end = timer()
+    report("verify (loop), n = {n}".format(n=n), end - start, iterations, "signature")
+
+    start = timer()
+    pk.verify_batch(messages, signatures)
+    end = timer()
+    report("verify_batch, n = {n}".format(n=n), end - start, iterations, "signature")
+
+
+def bench_recover_batch(n, batch_sizes, nb_sig=10):
+    """
+    Report the cost per signature of recover_batch for several batch sizes,
+    against a loop over recover. Batches cycle through nb_sig signatures.
+    """
+    sk = kat_secret_key(n)
+    messages = [i.to_bytes(4, "little") for i in range(nb_sig)]
+    signatures = [sk.sign_recoverable(message) for message in messages]
+
+    start = timer()
+    for i in range(nb_sig):
+        sk.recover(messages[i], signatures[i])
+    end = timer()
+    report("recover (loop), n = {n}".format(n=n), end - start, nb_sig, "signature")
+
+    for size in batch_sizes:
+        batch_messages = [messages[i % nb_sig] for i in range(size)]
+        batch_signatures = [signatures[i % nb_sig] for i in range(size)]
+        start = timer()
+        sk.recover_batch(batch_messages, batch_signatures)
+        end = timer()
+        report("recover_batch, {size} sigs".format(size=size), end - start, size, "signature")
+
+
+def bench_verify_and_recover(n, iterations, xof=None):
+    """
+    Compare verify_and_recover against the separate calls to
+    verify_recoverable, recover and key_fingerprint.
+    """
+    sk = kat_secret_key(n, xof=xof)
+    context = param_context(n, sk.xof)
+    fingerprint = sk.key_fingerprint()
+    messages = [i.to_bytes(4, "little") for i in range(10)]
+    signatures = [sk.sign_recoverable(message) for message in messages]
+
+    start = timer()
+    for i in range(iterations):
+        message, signature = messages[i % 10], signatures[i % 10]
+        if context.verify_recoverable(message, signature):
+            context.key_fingerprint(context.recover(message, signature)) == fingerprint
+    end = timer()
+    report("separate calls, n = {n}".format(n=n), end - start, iterations, "signature")
+
+    start = timer()
+    for i in range(iterations):
+        context.verify_and_recover(messages[i % 10], signatures[i % 10], fingerprint)
+    end = timer()
+    report("verify_and_recover, n = {n}".format(n=n), end - start, iterations, "signature")
+
+
+def bench_compact_recoverable(n, count):
+    """
+    Compare the default and the compact layouts of signatures in public key
+    recovery mode, on a corpus of count signatures: bytelength, and
+    throughput of encoding and decoding. Both layouts encode the same (s1, s2).
+    """
+    sk = kat_secret_key(n)
+    slen = Params[n]["sig_bytelen"] - SALT_LEN - HEAD_LEN
+    pairs = []
+    for i in range(count):
+        salt, s1, s2 = sk.split_and_decompress_signature(sk.sign_recoverable(i.to_bytes(4, "little")))
+        pairs += [(s1, s2)]
+    prefix = bytes(HEAD_LEN + SALT_LEN)
+    header = (COMPACT_HEADER + logn[n]).to_bytes(1, "little")
+
+    start = timer()
+    default = [prefix + compress(s1, slen) + compress(s2, slen) for (s1, s2) in pairs]
+    end = timer()
+    report("encode default layout, n = {n}".format(n=n), end - start, count, "signature")
+    start = timer()
+    compact = [header + bytes(SALT_LEN) + compress_compact(s1 + s2, 2 * slen) for (s1, s2) in pairs]
+    end = timer()
+    report("encode compact layout, n = {n}".format(n=n), end - start, count, "signature")
+
+    for (name, signatures) in [("default", default), ("compact", compact)]:
+        start = timer()
+        for signature in signatures:
+            sk.split_and_decompress_signature(signature)
+        end = timer()
+        report("decode {name} layout, n = {n}".format(name=name, n=n), end - start, count, "signature")
+        sizes = [len(signature) for signature in signatures]
+        message = "Bench {name} layout size, n = {n}".format(name=name, n=n).ljust(40) + ": "
+        message += "mean {mean} B, min {min} B, max {max} B".format(mean=round(sum(sizes) / count, 1), min=min(sizes), max=max(sizes)).rjust(40)
+        print(message)
+
+
+def bench_verify_multikey(n, batch_sizes, nb_keys=12):
+    """
+    Report the throughput of verify_batch_multikey for several batch sizes,
+    against a loop over verify. Triples are drawn from a pool of nb_keys
+    keys (at most the number of test vectors) with one signature each.
+    """
+    sks = [kat_secret_key(n, i) for i in range(nb_keys)]
+    pks = [PublicKey(n, sk.h) for sk in sks]
+    pool = [(pks[i], b"message", sks[i].sign(b"message")) for i in range(nb_keys)]
+
+    start = timer()
+    for (pk, message, signature) in pool:
+        pk.verify(message, signature)
+    end = timer()
+    report("verify (loop), n = {n}".format(n=n), end - start, nb_keys, "signature")
+
+    for size in batch_sizes:
+        triples = [pool[i % nb_keys] for i in range(size)]
+        keys = [elt[0] for elt in triples]
+        messages = [elt[1] for elt in triples]
+        signatures = [elt[2] for elt in triples]
+        start = timer()
+        verify_batch_multikey(keys, messages, signatures)
+        end = timer()
+        name = "verify_batch_multikey, {size} sigs".format(size=size)
+        report(name, end - start, size, "signature")
+        print("{rate} signatures / sec".format(rate=round(size / (end - start))).rjust(66))
+
+
+# Run all the benchmarks
+if (__name__ == "__main__"):
+    for n in [512, 1024]:
+        bench_keygen(n, 5)
+        bench_ntrugen(n, 5)
+        bench_gen_poly(n, 1000)
+        bench_expand(n, 20)
+        bench_tree(n, 20)
+        bench_sign(n, 100)
+        bench_preimage_target(n, 100)
+        bench_sign_recoverable(n, 100)
+        bench_entropy_pool(n, 50)
+        bench_chacha20(n, 1000)
+        bench_hash_to_point(n, 1000)
+        bench_compress(n, 1000)
+        bench_verify_batch(n, 100)
+        bench_verify_and_recover(n, 100)
+        bench_xof(n, 100)
+        print("")
+    bench_verify_multikey(512, [1, 16, 256, 4096])
+    print("")
+    bench_recover_batch(512, [1, 16, 256, 4096])
+    print("")
+    bench_compact_recoverable(512, 1000)
+    bench_compact_recoverable(1024, 500)
+    print("")
+    bench_samplerz(4096, 10)
+    print("")
+    bench_keystore(512, [1, 100, 1000])
+    print("")
+    bench_keygen_pool(512, 20, 20)
+    print("")
+    bench_ntrugen_stats(512, 100)
+    bench_ntrugen_stats(1024, 20)
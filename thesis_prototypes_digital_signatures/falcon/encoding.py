@@ -1,35 +1,105 @@
 """
-Compression and decompression routines for signatures.
+Compression and decompression routines for signatures,
+and encoding routines for public keys.
 """
+from falcon.common import q
 
 
-def compress(v, slen):
+def compress_compact(v, slen):
     """
     Take as input a list of integers v and a bytelength slen, and
-    return a bytestring of length slen that encode/compress v.
+    return a bytestring of length at most slen that encode/compress v.
     If this is not possible, return False.
 
     For each coefficient of v:
     - the sign is encoded on 1 bit
     - the 7 lower bits are encoded naively (binary)
     - the high bits are encoded in unary encoding
+    The last byte is padded with zero bits if needed.
+
+    Bits are accumulated in an integer and written to the output
+    a byte at a time, as soon as 8 of them are available.
     """
-    u = ""
+    x = bytearray()
+    # The acc_len lowest bits of acc are not written yet
+    acc, acc_len = 0, 0
     for coef in v:
-        # Encode the sign
-        s = "1" if coef < 0 else "0"
-        # Encode the low bits
-        s += format((abs(coef) % (1 << 7)), '#09b')[2:]
+        s = abs(coef)
+        # Encode the sign and the low bits
+        acc = (acc << 8) | ((coef < 0) << 7) | (s & 0x7F)
         # Encode the high bits
-        s += "0" * (abs(coef) >> 7) + "1"
-        u += s
-    # The encoding is too long
-    if len(u) > 8 * slen:
+        acc = (acc << ((s >> 7) + 1)) | 1
+        acc_len += 9 + (s >> 7)
+        while acc_len >= 8:
+            acc_len -= 8
+            x.append((acc >> acc_len) & 0xFF)
+        acc &= (1 << acc_len) - 1
+        # The encoding is too long
+        if len(x) > slen:
+            return False
+    if acc_len > 0:
+        x.append((acc << (8 - acc_len)) & 0xFF)
+    if len(x) > slen:
+        return False
+    return bytes(x)
+
+
+def compress(v, slen):
+    """
+    Take as input a list of integers v and a bytelength slen, and
+    return a bytestring of length slen that encode/compress v:
+    the output of compress_compact, padded with zero bytes.
+    If this is not possible, return False.
+    """
+    x = compress_compact(v, slen)
+    if x is False:
         return False
-    u += "0" * (8 * slen - len(u))
-    w = [int(u[8 * i: 8 * i + 8], 2) for i in range(len(u) // 8)]
-    x = bytes(w)
-    return x
+    return x + bytes(slen - len(x))
+
+
+def decode_coefficients(x, n):
+    """
+    Decode the first n coefficients encoded in x, as in compress_compact.
+    Return (v, rest, i), where v is the list of coefficients, rest is
+    the integer formed by the unread bits of the last read byte, and i is
+    the number of bytes read; or False if x is not a valid encoding.
+
+    x is read a byte at a time into an integer holding the bits
+    not consumed yet; reading past the end of x invalidates it.
+    """
+    v = []
+    # The acc_len lowest bits of acc are read but not consumed yet
+    acc, acc_len, i = 0, 0, 0
+    while len(v) < n:
+        # Read the sign and the 7 low bits of abs(coef)
+        while acc_len < 8:
+            if i == len(x):
+                return False
+            acc = (acc << 8) | x[i]
+            acc_len += 8
+            i += 1
+        acc_len -= 8
+        sign = -1 if (acc >> (acc_len + 7)) & 1 else 1
+        low = (acc >> acc_len) & 0x7F
+        acc &= (1 << acc_len) - 1
+        # Recover the high bits of abs(coef), i.e. the zeros before the next one
+        high = 0
+        while acc == 0:
+            high += acc_len
+            if i == len(x):
+                return False
+            acc, acc_len = x[i], 8
+            i += 1
+        high += acc_len - acc.bit_length()
+        acc_len = acc.bit_length() - 1
+        acc &= (1 << acc_len) - 1
+        # Compute coef
+        coef = sign * (low + (high << 7))
+        # Enforce a unique encoding for coef = 0
+        if (coef == 0) and (sign == -1):
+            return False
+        v += [coef]
+    return v, acc, i
 
 
 def decompress(x, slen, n):
@@ -41,39 +111,61 @@ def decompress(x, slen, n):
     if (len(x) > slen):
         print("Too long")
         return False
-    w = list(x)
-    u = ""
-    for elt in w:
-        u += bin((1 << 8) ^ elt)[3:]
-    v = []
+    decoded = decode_coefficients(x, n)
+    if decoded is False:
+        return False
+    return decoded[0]
 
-    # Remove the last bits
-    while u[-1] == "0":
-        u = u[:-1]
-
-    try:
-        while (u != "") and (len(v) < n):
-            # Recover the sign of coef
-            sign = -1 if u[0] == "1" else 1
-            # Recover the 7 low bits of abs(coef)
-            low = int(u[1:8], 2)
-            i, high = 8, 0
-            # Recover the high bits of abs(coef)
-            while (u[i] == "0"):
-                i += 1
-                high += 1
-            # Compute coef
-            coef = sign * (low + (high << 7))
-            # Enforce a unique encoding for coef = 0
-            if (coef == 0) and (sign == -1):
-                return False
-            # Store intermediate results
-            v += [coef]
-            u = u[i + 1:]
-        # In this case, the encoding is invalid
-        if (len(v) != n):
-            return False
-        return v
-    # IndexError is raised if indices are read outside the table bounds
-    except IndexError:
+
+def decompress_compact(x, slen, n):
+    """
+    Take as input an encoding x, a bytelength slen and a length n, and
+    return the list of integers v of length n such that
+    x = compress_compact(v, slen).
+    If such a list does not exist, the encoding is invalid and we output False.
+
+    Unlike decompress, the encoding must end with the last coefficient:
+    the padding bits must be zero, and no byte may follow.
+    """
+    if (len(x) > slen):
+        return False
+    decoded = decode_coefficients(x, n)
+    if decoded is False:
+        return False
+    v, rest, i = decoded
+    if (rest != 0) or (i != len(x)):
+        return False
+    return v
+
+
+def modq_encode(v):
+    """
+    Take as input a list of integers v in [0, q) and return a bytestring
+    that encodes each coefficient on 14 bits (big-endian bit order).
+    The last byte is padded with zero bits if needed.
+    """
+    x = 0
+    for coef in v:
+        x = (x << 14) | coef
+    pad = (- 14 * len(v)) % 8
+    return (x << pad).to_bytes((14 * len(v) + pad) // 8, "big")
+
+
+def modq_decode(x, n):
+    """
+    Take as input an encoding x and a length n, and return the list of
+    n integers in [0, q) encoded by x.
+    If x is not the canonical encoding of such a list, we output False.
+    """
+    pad = (- 14 * n) % 8
+    if (len(x) != (14 * n + pad) // 8):
+        return False
+    u = int.from_bytes(x, "big")
+    # The padding bits must be zero
+    if u & ((1 << pad) - 1):
+        return False
+    u >>= pad
+    v = [(u >> (14 * (n - 1 - i))) & 0x3FFF for i in range(n)]
+    if any(coef >= q for coef in v):
         return False
+    return v
@@ -5,20 +5,23 @@ https://falcon-sign.info/.
 from inspect import Signature
 
 from falcon.common import q
-from numpy import set_printoptions
+from numpy import set_printoptions, array, ones, zeros, rint, frombuffer, int64
+from numpy import sqrt as sqrt_batch
 from math import sqrt
-from falcon.fft import fft, ifft, sub, neg, add_fft, mul_fft
-from falcon.ntt import sub_zq, mul_zq, div_zq, ntt, intt
-from falcon.ffsampling import gram, ffldl_fft, ffsampling_fft
+from falcon.fft import neg, fft_batch, ifft_batch
+from falcon.ntt import sub_zq, div_zq, ntt, intt, mul_ntt
+from falcon.ntt import ntt_batch, intt_batch, inv_mod_q_array
+from falcon.ffsampling import ffldl_flat, ffsampling_flat, flat_tree_lists
 from falcon.ntrugen import ntru_gen
-from falcon.encoding import compress, decompress
+from falcon.encoding import compress, decompress, modq_encode, modq_decode
+from falcon.encoding import compress_compact, decompress_compact
 # https://pycryptodome.readthedocs.io/en/latest/src/hash/shake256.html
 from Crypto.Hash import SHAKE256, TurboSHAKE256, cSHAKE256, KangarooTwelve
 # Randomness
 from os import urandom#, MFD_ALLOW_SEALING
 
-from falcon.ntt_constants import inv_mod_q
-from falcon.rng import ChaCha20
+from falcon.rng import FastChaCha20, EntropyPool
+from threading import Lock
 # For debugging purposes
 import sys
 if sys.version_info >= (3, 4):
@@ -45,6 +48,27 @@ logn = {
 HEAD_LEN = 1
 SALT_LEN = 40
 SEED_LEN = 56
+# Header of compact signatures in public key recovery mode is COMPACT_HEADER + logn.
+# Falcon's headers are 0cc1nnnn where cc is the format, and cc = 11 is unused.
+COMPACT_HEADER = 0x70
+# Bytelength of the fingerprint of a public key (see ParamContext.key_fingerprint)
+FINGERPRINT_LEN = 32
+
+
+# Extendable-output functions available for hash_to_point.
+# Each entry maps a name to a function returning a fresh XOF object.
+XOFS = {
+    "SHAKE256": SHAKE256.new,
+    "TurboSHAKE256": TurboSHAKE256.new,
+    "cSHAKE256": cSHAKE256.new,
+    "KangarooTwelve": KangarooTwelve.new
+}
+
+# XOF used by keys that do not specify one; SHAKE256 is the one of the spec.
+default_xof = "SHAKE256"
+
+# Source of randomness when signing with the default randomness (urandom)
+default_pool = EntropyPool()
 
 
 # Parameter sets for Falcon:
@@ -137,66 +161,368 @@ Params = {
 }
 
 
-def print_tree(tree, pref=""):
+def normalize_tree(tree, sigma):
     """
-    Display a LDL tree in a readable form.
+    Normalize leaves of a LDL tree (from values ||b_i||**2 to sigma/||b_i||).
 
     Args:
         T: a LDL tree
+        sigma: a standard deviation
 
     Format: coefficient or fft
     """
-    leaf = "|_____> "
-    top = "|_______"
-    son1 = "|       "
-    son2 = "        "
-    width = len(top)
-
-    a = ""
     if len(tree) == 3:
-        if (pref == ""):
-            a += pref + str(tree[0]) + "\n"
-        else:
-            a += pref[:-width] + top + str(tree[0]) + "\n"
-        a += print_tree(tree[1], pref + son1)
-        a += print_tree(tree[2], pref + son2)
-        return a
-
+        normalize_tree(tree[1], sigma)
+        normalize_tree(tree[2], sigma)
     else:
-        return (pref[:-width] + leaf + str(tree) + "\n")
+        tree[0] = sigma / sqrt(tree[0].real)
+        # Leaves in coefficient representation have a second (zero) coefficient
+        for i in range(1, len(tree)):
+            tree[i] = 0
 
 
-def normalize_tree(tree, sigma):
+def verify_tile(context, public_keys, h_ntt, messages, signatures):
     """
-    Normalize leaves of a LDL tree (from values ||b_i||**2 to sigma/||b_i||).
+    Verify a tile of signatures. The public keys must share the same n.
+    Return a boolean array whose i-th entry is True if and only if
+    signatures[i] is a valid signature of messages[i] under public_keys[i].
 
     Args:
-        T: a LDL tree
-        sigma: a standard deviation
+        context: the parameter set of the keys (a ParamContext or a PublicKey)
+        public_keys: a list of public keys
+        h_ntt: an int64 array holding the NTT of h, either of shape (n,)
+               if all keys are equal, or of shape (len(public_keys), n)
+        messages: a list of messages
+        signatures: a list of signatures
+
+    All products s1 * h are computed in one batched NTT pass,
+    and all the norms are checked at once.
+    """
+    n = context.n
+    slen = context.sig_bytelen - HEAD_LEN - SALT_LEN
+    nb_sig = len(signatures)
+    valid = ones(nb_sig, dtype=bool)
+    if (nb_sig == 0):
+        return valid
+    s1 = zeros((nb_sig, n), dtype=int64)
+    hashed = zeros((nb_sig, n), dtype=int64)
+
+    # Unpack the salts and the short polynomials s1
+    for i in range(nb_sig):
+        salt = signatures[i][HEAD_LEN:HEAD_LEN + SALT_LEN]
+        enc_s = signatures[i][HEAD_LEN + SALT_LEN:]
+        s1_i = decompress(enc_s, slen, n)
+        # Invalid encodings are rejected, the row of s1 is left at zero
+        if (s1_i is False):
+            valid[i] = False
+            continue
+        s1[i] = s1_i
+        hashed[i] = public_keys[i].hash_to_point(messages[i], salt)
+
+    # Compute all s0 and normalize their coefficients in (-q/2, q/2]
+    s1h = intt_batch((ntt_batch(s1) * h_ntt) % q)
+    s0 = (hashed - s1h + (q >> 1)) % q - (q >> 1)
+
+    # Check that all (s0, s1) are short
+    norm_sign = (s0 ** 2).sum(axis=1) + (s1 ** 2).sum(axis=1)
+    return valid & (norm_sign <= context.signature_bound)
+
+
+def recover_tile(context, messages, signatures):
+    """
+    Recover the public keys of a tile of signatures in public key recovery mode,
+    for the parameter set of context (a ParamContext or a PublicKey).
+    Return a list whose i-th entry is the h recovered from messages[i] and
+    signatures[i], or False if the signature cannot be decoded or if its s2
+    is not invertible.
+
+    The NTTs of all s2 and of all targets (HashToPoint(r||m, q, n) - s1) are
+    computed in one batched pass, and all the NTT coefficients of s2 are
+    inverted at once with a lookup in inv_mod_q_array.
+    """
+    n = context.n
+    nb_sig = len(signatures)
+    valid = ones(nb_sig, dtype=bool)
+    s2 = zeros((nb_sig, n), dtype=int64)
+    target = zeros((nb_sig, n), dtype=int64)
+
+    for i in range(nb_sig):
+        salt, s1_i, s2_i = context.split_and_decompress_signature(signatures[i])
+        # Invalid encodings are rejected, the rows are left at zero
+        if (s1_i is False) or (s2_i is False):
+            valid[i] = False
+            continue
+        s2[i] = s2_i
+        target[i] = context.hash_to_point(messages[i], salt)
+        target[i] -= s1_i
+
+    # public key = s2^(-1)(HashToPoint(r||m, q, n) - s1)
+    s2_ntt = ntt_batch(s2)
+    # s2 is invertible if and only if its NTT has no zero coefficient
+    valid &= s2_ntt.all(axis=1)
+    h = intt_batch((ntt_batch(target) * inv_mod_q_array[s2_ntt]) % q)
+    return [h[i].tolist() if valid[i] else False for i in range(nb_sig)]
+
+
+class ParamContext:
+    """
+    This class contains the public parameters of a parameter set (n, XOF),
+    and the operations that only depend on them: hashing to a point, and
+    verifying or recovering the public key of signatures in public key
+    recovery mode. These need no key object, see recover, recover_batch
+    and verify_recoverable.
+
+    Contexts are cached by param_context, and shared by all
+    the public and secret keys of a parameter set.
+    """
 
-    Format: coefficient or fft
+    def __init__(self, n, xof=None):
+        """
+        Initialize the context of a parameter set. The XOF of hash_to_point
+        is chosen by name among XOFS, and defaults to default_xof.
+        """
+        self.n = n
+        self.xof = default_xof if xof is None else xof
+        if self.xof not in XOFS:
+            raise ValueError("Unknown XOF: {xof}".format(xof=self.xof))
+        # The constructor is looked up once per parameter set, not per hash.
+        # The NTT twiddle factors are module-level tables of falcon.ntt.
+        self.new_xof = XOFS[self.xof]
+        self.signature_bound = Params[n]["sig_bound"]
+        self.sig_bytelen = Params[n]["sig_bytelen"]
+        # Bytelength of the encoding of a polynomial in a signature
+        self.slen = self.sig_bytelen - HEAD_LEN - SALT_LEN
+
+    def hash_to_point(self, message, salt):
+        """
+        Hash a message to a point in Z[x] mod(Phi, q).
+        Inspired by the Parse function from NewHope.
+
+        The XOF is squeezed in large chunks, which are converted and
+        filtered at once. The output is the same as when reading the
+        XOF two bytes at a time.
+        """
+        n = self.n
+        if q > (1 << 16):
+            raise ValueError("The modulus is too large")
+
+        k = (1 << 16) // q
+        # Create a XOF object and hash the salt and message.
+        shake = self.new_xof()
+        shake.update(salt)
+        shake.update(message)
+        # Output pseudorandom bytes and map them to coefficients.
+        hashed = []
+        missing = n
+        while missing > 0:
+            # Read a few more 16-bit integers than missing coefficients,
+            # so that rejections rarely require another read.
+            nb_elts = missing + (missing >> 3) + 8
+            # Each pair of bytes is a big-endian 16 bits integer
+            elts = frombuffer(shake.read(2 * nb_elts), dtype=">u2")
+            # Implicit rejection sampling
+            elts = elts[elts < k * q][:missing] % q
+            hashed += elts.tolist()
+            missing -= len(elts)
+        return hashed
+
+    def split_and_decompress_signature(self, signature):
+        """
+        Split a signature in public key recovery mode into (salt, s1, s2).
+        s1 or s2 is False if its encoding is invalid.
+        Both layouts of sign_recoverable are accepted, and told apart by
+        their header. A compact signature is decoded in a single pass.
+        """
+        salt = signature[HEAD_LEN:HEAD_LEN + SALT_LEN]
+
+        enc_s = signature[HEAD_LEN + SALT_LEN:]
+        if (len(signature) > 0) and (signature[0] == COMPACT_HEADER + logn[self.n]):
+            s = decompress_compact(enc_s, 2 * self.slen, 2 * self.n)
+            if s is False:
+                return (salt, False, False)
+            return (salt, s[:self.n], s[self.n:])
+
+        # Both halves are padded to slen bytes, so that a signature of
+        # another length cannot be split at the right offset
+        if (len(enc_s) != 2 * self.slen):
+            return (salt, False, False)
+        enc_s1 = enc_s[:self.slen]
+        enc_s2 = enc_s[self.slen:]
+
+        s1 = decompress(enc_s1, self.slen, self.n)
+        s2 = decompress(enc_s2, self.slen, self.n)
+
+        return (salt, s1, s2)
+
+    def verify_recoverable(self, message, signature):
+        """
+        Verify a signature in public key recovery mode: its encoding
+        must be valid, and (s1, s2) must be short.
+        """
+        result = self.split_and_decompress_signature(signature)
+
+        s1 = result[1]
+        s2 = result[2]
+
+        # Check that the encoding is valid
+        if (s1 is False or s2 is False):
+            print("Invalid encoding")
+            return False
+
+        # Check that the (s1, s2) is short
+        norm_sign = sum(coef ** 2 for coef in s1)
+        norm_sign += sum(coef ** 2 for coef in s2)
+        if norm_sign > self.signature_bound:
+            print("Squared norm of signature is too large:", norm_sign)
+            return False
+
+        # If all checks are passed, accept
+        return True
+
+    def encode_public_key(self, h):
+        """
+        Encode h as in Falcon's documentation: a header byte
+        followed by the coefficients of h, each on 14 bits.
+        """
+        header = logn[self.n].to_bytes(1, "little")
+        return header + modq_encode(h)
+
+    def key_fingerprint(self, h):
+        """
+        Return the fingerprint of the public key h: the first FINGERPRINT_LEN
+        bytes of the XOF of the parameter set on the encoding of h.
+        """
+        shake = self.new_xof()
+        shake.update(self.encode_public_key(h))
+        return shake.read(FINGERPRINT_LEN)
+
+    def verify_and_recover(self, message, signature, expected_key_hash):
+        """
+        Verify a signature in public key recovery mode, and check that the
+        fingerprint of its recovered public key is expected_key_hash.
+        Return True if and only if both checks pass.
+
+        This does the work of verify_recoverable, recover and key_fingerprint,
+        but decodes the signature once and hashes the message once, and
+        transforms s2 and the target in a single batched NTT.
+        """
+        salt, s1, s2 = self.split_and_decompress_signature(signature)
+        if (s1 is False) or (s2 is False):
+            return False
+        norm_sign = sum(coef ** 2 for coef in s1)
+        norm_sign += sum(coef ** 2 for coef in s2)
+        if norm_sign > self.signature_bound:
+            return False
+
+        # public key = s2^(-1)(HashToPoint(r||m, q, n) - s1)
+        target = array(self.hash_to_point(message, salt), dtype=int64) - array(s1, dtype=int64)
+        target_ntt, s2_ntt = ntt_batch([target, s2])
+        # s2 is invertible if and only if its NTT has no zero coefficient
+        if not s2_ntt.all():
+            return False
+        h = intt_batch((target_ntt * inv_mod_q_array[s2_ntt]) % q)
+        return self.key_fingerprint(h.tolist()) == expected_key_hash
+
+    def recover(self, message, signature):
+        """
+        Recover the public key h of a signature in public key recovery mode.
+        Return False if the signature cannot be decoded or if its s2
+        is not invertible.
+        """
+        return recover_tile(self, [message], [signature])[0]
+
+    def recover_batch(self, messages, signatures):
+        """
+        Recover the public keys of a batch of signatures in public key
+        recovery mode. Return a list whose i-th entry is the h recovered
+        from messages[i] and signatures[i], or False if signatures[i] cannot
+        be decoded or if its s2 is not invertible.
+
+        The signatures are recovered by tiles of TILE_SIZE signatures.
+        """
+        assert len(messages) == len(signatures)
+        result = []
+        for start in range(0, len(signatures), TILE_SIZE):
+            end = start + TILE_SIZE
+            result += recover_tile(self, messages[start:end], signatures[start:end])
+        return result
+
+
+# Contexts of the parameter sets, by (n, XOF)
+contexts = dict()
+
+
+def param_context(n, xof=None):
+    """Return the (cached) context of the parameter set (n, xof)."""
+    xof = default_xof if xof is None else xof
+    if (n, xof) not in contexts:
+        contexts[(n, xof)] = ParamContext(n, xof)
+    return contexts[(n, xof)]
+
+
+def recover(n, message, signature, xof=None):
     """
-    if len(tree) == 3:
-        normalize_tree(tree[1], sigma)
-        normalize_tree(tree[2], sigma)
-    else:
-        tree[0] = sigma / sqrt(tree[0].real)
-        tree[1] = 0
+    Recover the public key h of a signature in public key recovery mode,
+    for the parameter set (n, xof). Return False if the signature is invalid.
+    """
+    return param_context(n, xof).recover(message, signature)
+
+
+def recover_batch(n, messages, signatures, xof=None):
+    """
+    Recover the public keys of a batch of signatures in public key
+    recovery mode, for the parameter set (n, xof).
+    """
+    return param_context(n, xof).recover_batch(messages, signatures)
+
+
+def verify_and_recover(n, message, signature, expected_key_hash, xof=None):
+    """
+    Verify a signature in public key recovery mode, and check that the
+    fingerprint of its public key is expected_key_hash,
+    for the parameter set (n, xof).
+    """
+    return param_context(n, xof).verify_and_recover(message, signature, expected_key_hash)
+
+
+def verify_recoverable(n, message, signature, xof=None):
+    """
+    Verify a signature in public key recovery mode,
+    for the parameter set (n, xof).
+    """
+    return param_context(n, xof).verify_recoverable(message, signature)
 
 
 class PublicKey:
     """
     This class contains methods for performing public key operations in Falcon.
+
+    A public key only needs h (or its encoding), hence it can be
+    instantiated without ever building the secret key.
     """
 
-    def __init__(self, sk):
-        """Initialize a public key."""
-        self.n = sk.n
-        self.h = sk.h
-        self.hash_to_point = sk.hash_to_point
-        self.signature_bound = sk.signature_bound
-        self.verify = sk.verify
-        self.verify_recoverable = sk.verify_recoverable
+    def __init__(self, n, h, xof=None, h_ntt=None):
+        """
+        Initialize a public key from h, given either as a list
+        of coefficients or as its encoding (see encode_public_key).
+        The XOF of hash_to_point is chosen by name among XOFS,
+        and defaults to default_xof.
+        Optionally, one can provide h_ntt = ntt(h) if it is already known.
+        """
+        self.n = n
+        # The public parameters are shared by all the keys of a parameter set
+        self.context = param_context(n, xof)
+        self.xof = self.context.xof
+        self.new_xof = self.context.new_xof
+        self.signature_bound = self.context.signature_bound
+        self.sig_bytelen = self.context.sig_bytelen
+        if isinstance(h, (bytes, bytearray)):
+            h = self.decode_public_key(h)
+        assert (len(h) == n)
+        self.h = h[:]
+        # h is only used in products s1 * h, so we store its NTT once
+        # and save two transforms on each verification.
+        self.h_ntt = ntt(self.h) if h_ntt is None else list(h_ntt)
 
     def __repr__(self):
         """Print the object in readable form."""
@@ -204,8 +530,116 @@ class PublicKey:
         rep += "h = {h}\n".format(h=self.h)
         return rep
 
+    def encode_public_key(self):
+        """
+        Encode h as in Falcon's documentation: a header byte
+        followed by the coefficients of h, each on 14 bits.
+        """
+        return self.context.encode_public_key(self.h)
+
+    def key_fingerprint(self):
+        """Return the fingerprint of this public key, see ParamContext.key_fingerprint."""
+        return self.context.key_fingerprint(self.h)
+
+    def decode_public_key(self, x):
+        """
+        Decode an encoding of h produced by encode_public_key.
+        Raise a ValueError if the encoding is invalid.
+        """
+        if (len(x) == 0) or (x[0] != logn[self.n]):
+            raise ValueError("Invalid public key header")
+        h = modq_decode(x[HEAD_LEN:], self.n)
+        if h is False:
+            raise ValueError("Invalid public key encoding")
+        return h
+
+    def hash_to_point(self, message, salt):
+        """
+        Hash a message to a point in Z[x] mod(Phi, q),
+        see ParamContext.hash_to_point.
+        """
+        return self.context.hash_to_point(message, salt)
+
+    def verify(self, message, signature):
+        """
+        Verify a signature.
+        """
+        # Unpack the salt and the short polynomial s1
+        salt = signature[HEAD_LEN:HEAD_LEN + SALT_LEN]
+        enc_s = signature[HEAD_LEN + SALT_LEN:]
+        s1 = decompress(enc_s, self.sig_bytelen - HEAD_LEN - SALT_LEN, self.n)
+
+        # Check that the encoding is valid
+        if (s1 is False):
+            print("Invalid encoding")
+            return False
+
+        # Compute s0 and normalize its coefficients in (-q/2, q/2]
+        hashed = self.hash_to_point(message, salt)
+        # The product s1 * h is computed in the NTT domain
+        s1h = intt(mul_ntt(ntt(s1), self.h_ntt))
+        s0 = sub_zq(hashed, s1h)
+        s0 = [(coef + (q >> 1)) % q - (q >> 1) for coef in s0]
+
+        # Check that the (s0, s1) is short
+        norm_sign = sum(coef ** 2 for coef in s0)
+        norm_sign += sum(coef ** 2 for coef in s1)
+        if norm_sign > self.signature_bound:
+            print("Squared norm of signature is too large:", norm_sign)
+            return False
+
+        # If all checks are passed, accept
+        return True
+
+    def verify_batch(self, messages, signatures):
+        """
+        Verify a batch of signatures under this public key.
+        Return a boolean array whose i-th entry is True if and only if
+        signatures[i] is a valid signature of messages[i].
+
+        All products s1 * h are computed in one batched NTT pass,
+        and all the norms are checked at once.
+        """
+        assert len(messages) == len(signatures)
+        public_keys = [self] * len(signatures)
+        return verify_tile(self, public_keys, array(self.h_ntt, dtype=int64), messages, signatures)
+
+    def recover(self, message, signature):
+        """
+        Recover the public key h of a signature in public key recovery mode,
+        with the parameter set of this key, see ParamContext.recover.
+        """
+        return self.context.recover(message, signature)
+
+    def recover_batch(self, messages, signatures):
+        """
+        Recover the public keys of a batch of signatures in public key
+        recovery mode, with the parameter set of this key,
+        see ParamContext.recover_batch.
+        """
+        return self.context.recover_batch(messages, signatures)
+
+    def split_and_decompress_signature(self, signature):
+        """Split a signature in public key recovery mode into (salt, s1, s2)."""
+        return self.context.split_and_decompress_signature(signature)
+
+    # Verification of a Falcon signature on a message in public key recovery mode
+    def verify_recoverable(self, message, signature):
+        """Verify a signature in public key recovery mode."""
+        return self.context.verify_recoverable(message, signature)
+
+
+def expansion(B0_fft, T_fft):
+    """
+    Return the expansion [B0_fft, T_fft, inv_B0_row_fft] of a secret key.
+    B0 has determinant q, so the first row of its inverse is [d, -b] / q,
+    with B0 = [[a, b], [c, d]]. It maps a point to the target of sample_preimage.
+    """
+    [[a, b], [c, d]] = B0_fft
+    return [B0_fft, T_fft, array([d / q, -b / q])]
+
 
-class SecretKey:
+class SecretKey(PublicKey):
     """
     This class contains methods for performing
     secret key operations (and also public key operations) in Falcon.
@@ -221,8 +655,12 @@ class SecretKey:
     - verify the signature of a message
     """
 
-    def __init__(self, n, polys=None):
-        """Initialize a secret key."""
+    def __init__(self, n, polys=None, xof=None, expanded=None):
+        """
+        Initialize a secret key, whose XOF is chosen as for PublicKey.
+        Optionally, one can provide the expanded key [h, h_ntt, B0_fft, T_fft]
+        of polys (see falcon.keystore), which is then not recomputed.
+        """
         # Public parameters
         self.n = n
         self.sigma = Params[n]["sigma"]
@@ -241,20 +679,86 @@ class SecretKey:
             self.F = F[:]
             self.G = G[:]
 
-        # From f, g, F, G, compute the basis B0 of a NTRU lattice
-        # as well as its Gram matrix and their fft's.
-        B0 = [[self.g, neg(self.f)], [self.G, neg(self.F)]]
-        G0 = gram(B0)
-        self.B0_fft = [[fft(elt) for elt in row] for row in B0]
-        G0_fft = [[fft(elt) for elt in row] for row in G0]
+        # B0_fft and the ffLDL tree are only needed to sign: they are
+        # computed by expand, on first use, and can be dropped by shrink.
+        self.lock = Lock()
+        self.expansion = None
+        if expanded is not None:
+            h, h_ntt, B0_fft, T_fft = expanded
+            self.expansion = expansion(B0_fft, T_fft)
+        else:
+            # The public key is a polynomial such that h*f = g mod (Phi,q)
+            h, h_ntt = div_zq(self.g, self.f), None
+
+        super().__init__(n, h, xof, h_ntt)
+
+    def __getstate__(self):
+        """Pickle the key without its lock."""
+        state = self.__dict__.copy()
+        del state["lock"], state["new_xof"], state["context"]
+        return state
 
-        self.T_fft = ffldl_fft(G0_fft)
+    def __setstate__(self, state):
+        """Unpickle a key pickled by __getstate__."""
+        self.__dict__.update(state)
+        self.lock = Lock()
+        self.context = param_context(self.n, self.xof)
+        self.new_xof = self.context.new_xof
+
+    def expand(self):
+        """
+        Return the expansion [B0_fft, T_fft, inv_B0_row_fft] of the key,
+        and compute it on first use. T_fft holds the flattened tree and the
+        list forms of its arrays (see flat_tree_lists). It is safe to call from
+        several threads: the expansion is computed once, and published in a
+        single assignment.
+        """
+        expanded = self.expansion
+        if (expanded is None) or (len(expanded[1]) == 2):
+            with self.lock:
+                expanded = self.expansion
+                if (expanded is not None) and (len(expanded[1]) == 2):
+                    # Keys loaded from a key file get the list forms of their tree on first use
+                    expanded = [expanded[0], flat_tree_lists(expanded[1]), expanded[2]]
+                    self.expansion = expanded
+                elif expanded is None:
+                    # From f, g, F, G, compute the basis B0 of a NTRU lattice
+                    # as well as its Gram matrix and their fft's.
+                    # The four entries of B0 are transformed in a single batched FFT,
+                    # and the Gram matrix is computed directly in FFT representation.
+                    B0 = [[self.g, neg(self.f)], [self.G, neg(self.F)]]
+                    B0_fft = fft_batch(B0)
+                    G0_fft = (B0_fft[:, None] * B0_fft[None, :].conjugate()).sum(axis=2)
+
+                    # The tree is stored flattened: arrays of the l10 of each depth, and of the leaves
+                    T_fft = ffldl_flat(G0_fft)
+
+                    # Normalize Falcon tree
+                    T_fft[1] = self.sigma / sqrt_batch(T_fft[1])
+
+                    # ffsampling_flat reuses the list forms of the lower levels of the tree
+                    expanded = expansion(B0_fft, flat_tree_lists(T_fft))
+                    self.expansion = expanded
+        return expanded
+
+    def shrink(self):
+        """
+        Drop the expansion of the key to reclaim its memory, e.g. for idle keys.
+        It is recomputed by the next signature. Signatures in progress
+        in other threads keep using the expansion they started with.
+        """
+        with self.lock:
+            self.expansion = None
 
-        # Normalize Falcon tree
-        normalize_tree(self.T_fft, self.sigma)
+    @property
+    def B0_fft(self):
+        """The basis B0 in FFT representation (see expand)."""
+        return self.expand()[0]
 
-        # The public key is a polynomial such that h*f = g mod (Phi,q)
-        self.h = div_zq(self.g, self.f)
+    @property
+    def T_fft(self):
+        """The normalized, flattened ffLDL tree of the key (see expand)."""
+        return self.expand()[1]
 
     def __repr__(self, verbose=False):
         """Print the object in readable form."""
@@ -264,96 +768,85 @@ class SecretKey:
         rep += "F = {F}\n".format(F=self.F)
         rep += "G = {G}\n".format(G=self.G)
         if verbose:
-            rep += "\nFFT tree\n"
-            rep += print_tree(self.T_fft, pref="")
+            rep += "\nFFT tree (l10 of each depth, then leaves)\n"
+            rep += "".join(str(elt.tolist()) + "\n" for elt in self.T_fft[0])
+            rep += str(self.T_fft[1].tolist()) + "\n"
         return rep
 
-    def hash_to_point(self, message, salt):
+    def preimage_target(self, point):
         """
-        Hash a message to a point in Z[x] mod(Phi, q).
-        Inspired by the Parse function from NewHope.
+        Compute the target t_fft used by sample_preimage for a point.
+        It only depends on the point, so it is computed once per message
+        and reused by all the signing attempts.
         """
-        n = self.n
-        if q > (1 << 16):
-            raise ValueError("The modulus is too large")
-
-        k = (1 << 16) // q
-        # Create a SHAKE object and hash the salt and message.
-        shake = KangarooTwelve.new() # Changed for benchmarking the influence different XOF algorithms - default: SHAKE256
-        shake.update(salt)
-        shake.update(message)
-        # Output pseudorandom bytes and map them to coefficients.
-        hashed = [0 for i in range(n)]
-        i = 0
-        while i < n:
-            # Takes 2 bytes, transform them in a 16 bits integer
-            twobytes = shake.read(2)
-            elt = (twobytes[0] << 8) + twobytes[1]  # This breaks in Python 2.x
-            # Implicit rejection sampling
-            if elt < k * q:
-                hashed[i] = elt % q
-                i += 1
-        return hashed
+        # We compute a vector t_fft such that:
+        #     (fft(point), fft(0)) * B0_fft^(-1) = t_fft
+        # Because fft(0) = 0, only the first row of B0_fft^(-1) is needed,
+        # and it is precomputed in inv_B0_row_fft.
+        point_fft = fft_batch(point)
+        return (point_fft * self.expand()[2]).tolist()
 
-    def sample_preimage(self, point, seed=None):
+    def sample_preimage(self, point, seed=None, t_fft=None, pool=None):
         """
         Sample a short vector s such that s[0] + s[1] * h = point.
+        Optionally, one can provide the target t_fft = preimage_target(point).
+        Without a seed, randomness is drawn from pool (default: default_pool).
         """
-        [[a, b], [c, d]] = self.B0_fft
-
-        # We compute a vector t_fft such that:
-        #     (fft(point), fft(0)) * B0_fft = t_fft
-        # Because fft(0) = 0 and the inverse of B has a very specific form,
-        # we can do several optimizations.
-        point_fft = fft(point)
-        t0_fft = [(point_fft[i] * d[i]) / q for i in range(self.n)]
-        t1_fft = [(-point_fft[i] * b[i]) / q for i in range(self.n)]
-        t_fft = [t0_fft, t1_fft]
+        # The expansion is read once, in case another thread shrinks the key
+        B0_fft, T_fft, inv_B0_row_fft = self.expand()
+        if t_fft is None:
+            t_fft = self.preimage_target(point)
 
         # We now compute v such that:
         #     v = z * B0 for an integral vector z
         #     v is close to (point, 0)
         if seed is None:
-            # If no seed is defined, use urandom as the pseudo-random source.
-            z_fft = ffsampling_fft(t_fft, self.T_fft, self.sigmin, urandom)
+            # If no seed is defined, use the entropy pool as the random source.
+            pool = default_pool if pool is None else pool
+            z_fft = ffsampling_flat(t_fft, T_fft, self.sigmin, pool.randombytes)
         else:
             # If a seed is defined, initialize a ChaCha20 PRG
             # that is used to generate pseudo-randomness.
-            chacha_prng = ChaCha20(seed)
-            z_fft = ffsampling_fft(t_fft, self.T_fft, self.sigmin,
+            chacha_prng = FastChaCha20(seed)
+            z_fft = ffsampling_flat(t_fft, T_fft, self.sigmin,
                                    chacha_prng.randombytes)
 
-        v0_fft = add_fft(mul_fft(z_fft[0], a), mul_fft(z_fft[1], c))
-        v1_fft = add_fft(mul_fft(z_fft[0], b), mul_fft(z_fft[1], d))
-        v0 = [int(round(elt)) for elt in ifft(v0_fft)]
-        v1 = [int(round(elt)) for elt in ifft(v1_fft)]
+        # Both rows of v = z * B0 are computed at once
+        v_fft = (array(z_fft)[:, None] * B0_fft).sum(axis=0)
+        v = rint(ifft_batch(v_fft)).astype(int64)
 
         # The difference s = (point, 0) - v is such that:
         #     s is short
         #     s[0] + s[1] * h = point
-        s = [sub(point, v0), neg(v1)]
+        s = [(array(point, dtype=int64) - v[0]).tolist(), (- v[1]).tolist()]
         return s
 
-    def sign(self, message, randombytes=urandom):
+    def sign(self, message, randombytes=urandom, pool=None):
         """
         Sign a message. The message MUST be a byte string or byte array.
         Optionally, one can select the source of (pseudo-)randomness used
-        (default: urandom).
+        (default: urandom). With urandom, the bytes are drawn from pool
+        (default: default_pool), which reads urandom in large blocks.
         """
         int_header = 0x30 + logn[self.n]
         header = int_header.to_bytes(1, "little")
 
-        salt = randombytes(SALT_LEN)
+        if (randombytes == urandom):
+            pool = default_pool if pool is None else pool
+            salt = pool.randombytes(SALT_LEN)
+        else:
+            salt = randombytes(SALT_LEN)
         hashed = self.hash_to_point(message, salt)
+        t_fft = self.preimage_target(hashed)
 
         # We repeat the signing procedure until we find a signature that is
         # short enough (both the Euclidean norm and the bytelength)
         while (1):
             if (randombytes == urandom):
-                s = self.sample_preimage(hashed)
+                s = self.sample_preimage(hashed, t_fft=t_fft, pool=pool)
             else:
                 seed = randombytes(SEED_LEN)
-                s = self.sample_preimage(hashed, seed=seed)
+                s = self.sample_preimage(hashed, seed=seed, t_fft=t_fft)
             norm_sign = sum(coef ** 2 for coef in s[0])
             norm_sign += sum(coef ** 2 for coef in s[1])
             # Check the Euclidean norm
@@ -363,129 +856,79 @@ class SecretKey:
                 if (enc_s is not False):
                     return header + salt + enc_s
 
-    def verify(self, message, signature):
+    # Creation a Falcon signature on a message in public key recovery mode
+    def sign_recoverable(self, message, randombytes=urandom, pool=None, compact=False):
         """
-        Verify a signature.
+        Sign a message in public key recovery mode: the signature contains
+        both s1 and s2, and s2 MUST be invertible mod (Phi, q). The source of
+        (pseudo-)randomness is chosen as for sign.
+
+        By default, s1 and s2 are each compressed and padded to the length
+        of a signature. If compact is True, they are compressed back-to-back
+        in a single bitstream, which is only padded to a byte boundary
+        (see COMPACT_HEADER).
         """
-        # Unpack the salt and the short polynomial s1
-        salt = signature[HEAD_LEN:HEAD_LEN + SALT_LEN]
-        enc_s = signature[HEAD_LEN + SALT_LEN:]
-        s1 = decompress(enc_s, self.sig_bytelen - HEAD_LEN - SALT_LEN, self.n)
-
-        # Check that the encoding is valid
-        if (s1 is False):
-            print("Invalid encoding")
-            return False
-
-        # Compute s0 and normalize its coefficients in (-q/2, q/2]
-        hashed = self.hash_to_point(message, salt)
-        s0 = sub_zq(hashed, mul_zq(s1, self.h))
-        s0 = [(coef + (q >> 1)) % q - (q >> 1) for coef in s0]
-
-        # Check that the (s0, s1) is short
-        norm_sign = sum(coef ** 2 for coef in s0)
-        norm_sign += sum(coef ** 2 for coef in s1)
-        if norm_sign > self.signature_bound:
-            print("Squared norm of signature is too large:", norm_sign)
-            return False
-
-        # If all checks are passed, accept
-        return True
-
-    # Creation a Falcon signature on a message in public key recovery mode
-    def sign_recoverable(self, message, randombytes=urandom):
-        neutral_polynomial = [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-        int_header = 0x30 + logn[self.n]
+        int_header = (COMPACT_HEADER if compact else 0x30) + logn[self.n]
         header = int_header.to_bytes(1, "little")
-        salt = randombytes(SALT_LEN)
+        if randombytes == urandom:
+            pool = default_pool if pool is None else pool
+            salt = pool.randombytes(SALT_LEN)
+        else:
+            salt = randombytes(SALT_LEN)
         hashed = self.hash_to_point(message, salt)
+        t_fft = self.preimage_target(hashed)
 
         while 1:
             if randombytes == urandom:
-                s = self.sample_preimage(hashed)
+                s = self.sample_preimage(hashed, t_fft=t_fft, pool=pool)
             else:
                 seed = randombytes(SEED_LEN)
-                s = self.sample_preimage(hashed, seed=seed)
-
-
-            # Checking if the s2 polynomial is revertible mod q
-            # which is necessary for the public key recovery mode equation:
-            # public key = s2^(-1)(HashToPoint(r||m, q, n) - s1)
-            ntt_s2 = ntt(s[1])
-            ntt_inv_s2 = []
-
-            for i in range(0, len(ntt_s2)):
-                ntt_inv_s2.append(inv_mod_q[ntt_s2[i]])
-
-            inv_s2 = intt(ntt_inv_s2)
-
-            # If s2 is not invertible mod q then repeat creation of s1 and s2
-            if not mul_zq(s[1], inv_s2) == neutral_polynomial:
-                continue
+                s = self.sample_preimage(hashed, seed=seed, t_fft=t_fft)
 
+            # The norm is checked first, since it is the cheapest test
             norm_sign = sum(coef ** 2 for coef in s[0])
             norm_sign += sum(coef ** 2 for coef in s[1])
+            if norm_sign > self.signature_bound:
+                continue
 
-            if norm_sign <= self.signature_bound:
-                enc_s1 = compress(s[0], self.sig_bytelen - HEAD_LEN - SALT_LEN)
-                enc_s2 = compress(s[1], self.sig_bytelen - HEAD_LEN - SALT_LEN)
-                if enc_s1 is not False and enc_s2 is not False:
-                    return header + salt + enc_s1 + enc_s2
-
-    def split_and_decompress_signature(self, signature):
-        salt = signature[HEAD_LEN:HEAD_LEN + SALT_LEN]
-
-        enc_s = signature[HEAD_LEN + SALT_LEN:]
-        enc_s1 = enc_s[:len(enc_s) // 2]
-        enc_s2 = enc_s[len(enc_s) // 2:]
-
-        s1 = decompress(enc_s1, self.sig_bytelen - HEAD_LEN - SALT_LEN, self.n)
-        s2 = decompress(enc_s2, self.sig_bytelen - HEAD_LEN - SALT_LEN, self.n)
-
-        return (salt, s1, s2)
-
-    # Recovery of the public key out of the Falcon signature in public key recovery mode
-    def recover(self, message, signature):
-        result = self.split_and_decompress_signature(signature)
-
-        salt = result[0]
-        s1 = result[1]
-        s2 = result[2]
-
-        if s1 is False or s2 is False:
-            print("Invalid encoding")
-            return False
-
-        # Usage of the equation for the public key recovery in the Falcon specification:
-        # public key = s2^(-1)(HashToPoint(r||m, q, n) - s1)
-        hashtopoint = self.hash_to_point(message, salt)
-        input = sub_zq(hashtopoint, s1)
-
-        recovered_key = div_zq(input, s2)
-
-        return recovered_key
-
-    # Verification of a Falcon signature on a message in public key recovery mode
-    def verify_recoverable(self, message, signature):
-        result = self.split_and_decompress_signature(signature)
-
-        s1 = result[1]
-        s2 = result[2]
+            # s2 must be invertible mod q, which is necessary for
+            # the public key recovery mode equation:
+            # public key = s2^(-1)(HashToPoint(r||m, q, n) - s1)
+            # s2 is invertible if and only if its NTT has no zero coefficient
+            if any((coef == 0) for coef in ntt(s[1])):
+                continue
 
-        # Check that the encoding is valid
-        if (s1 is False and s2 is False):
-            print("Invalid encoding")
-            return False
+            if compact:
+                enc_s = compress_compact(s[0] + s[1], 2 * (self.sig_bytelen - HEAD_LEN - SALT_LEN))
+                if enc_s is not False:
+                    return header + salt + enc_s
+                continue
+            enc_s1 = compress(s[0], self.sig_bytelen - HEAD_LEN - SALT_LEN)
+            enc_s2 = compress(s[1], self.sig_bytelen - HEAD_LEN - SALT_LEN)
+            if enc_s1 is not False and enc_s2 is not False:
+                return header + salt + enc_s1 + enc_s2
 
-        # Check that the (s0, s1) is short
-        norm_sign = sum(coef ** 2 for coef in s1)
-        norm_sign += sum(coef ** 2 for coef in s2)
-        if norm_sign > self.signature_bound:
-            print("Squared norm of signature is too large:", norm_sign)
-            return False
 
-        # If all checks are passed, accept
-        return True
+# Number of signatures verified at once by verify_batch_multikey
+TILE_SIZE = 256
 
 
+def verify_batch_multikey(public_keys, messages, signatures, tile_size=TILE_SIZE):
+    """
+    Verify a batch of (public key, message, signature) triples, where the
+    public keys may all be distinct but must share the same n.
+    Return a boolean array whose i-th entry is True if and only if
+    signatures[i] is a valid signature of messages[i] under public_keys[i].
 
+    The triples are grouped in tiles of tile_size elements; within a tile,
+    the NTT multiplications and the norm checks are whole-tile operations.
+    """
+    assert len(public_keys) == len(messages) == len(signatures)
+    assert all(pk.n == public_keys[0].n for pk in public_keys)
+    result = ones(len(signatures), dtype=bool)
+    for start in range(0, len(signatures), tile_size):
+        end = start + tile_size
+        tile_keys = public_keys[start:end]
+        h_ntt = array([pk.h_ntt for pk in tile_keys], dtype=int64)
+        result[start:end] = verify_tile(tile_keys[0], tile_keys, h_ntt, messages[start:end], signatures[start:end])
+    return result
@@ -3,12 +3,17 @@
 - the Fast Fourier orthogonalization (in coefficient and FFT representation)
 - the Fast Fourier nearest plane (in coefficient and FFT representation)
 - the Fast Fourier sampling (only in FFT)
+- flattened counterparts of the ffLDL tree and of the Fast Fourier sampling
 .
 """
 from falcon.common import split, merge                         # Split, merge
 from falcon.fft import add, sub, mul, div, adj                 # Operations in coef.
 from falcon.fft import add_fft, sub_fft, mul_fft, div_fft, adj_fft  # Ops in FFT
 from falcon.fft import split_fft, merge_fft, fft_ratio         # FFT
+from falcon.fft import fft_batch, ifft_batch, fft_twiddles     # Batched FFT
+from numpy import asarray, empty, zeros, stack, complex128     # Flattened tree
+from numpy import multiply, subtract, add as add_arrays        # In-place operations
+from threading import local                                    # Per-thread buffers
 from falcon.samplerz import samplerz                           # Gaussian sampler in Z
 
 
@@ -19,16 +24,13 @@ def gram(B):
         B: a matrix
 
     Format: coefficient
+
+    All the entries of B are transformed in a single batched FFT,
+    and the products B[i][k] * adj(B[j][k]) are summed in FFT representation.
     """
-    rows = range(len(B))
-    ncols = len(B[0])
-    deg = len(B[0][0])
-    G = [[[0 for coef in range(deg)] for j in rows] for i in rows]
-    for i in rows:
-        for j in rows:
-            for k in range(ncols):
-                G[i][j] = add(G[i][j], mul(B[i][k], adj(B[j][k])))
-    return G
+    B_fft = fft_batch(B)
+    G_fft = (B_fft[:, None] * B_fft[None, :].conjugate()).sum(axis=2)
+    return ifft_batch(G_fft).tolist()
 
 
 def ldl(G):
@@ -135,7 +137,7 @@ def ffldl_fft(G):
         G1 = [[d10, d11], [adj_fft(d11), d10]]
         return [L[1][0], ffldl_fft(G0), ffldl_fft(G1)]
     elif (n == 2):
-        # End of the recursion (each element is real).
+        # End of the recursion (each element has a single FFT coefficient, which is real).
         return [L[1][0], D[0][0], D[1][1]]
 
 
@@ -173,15 +175,19 @@ def ffnp_fft(t, T):
     """
     n = len(t[0]) * fft_ratio
     z = [0, 0]
-    if (n > 1):
+    if (n > 2):
         l10, T0, T1 = T
         z[1] = merge_fft(ffnp_fft(split_fft(t[1]), T1))
         t0b = add_fft(t[0], mul_fft(sub_fft(t[1], z[1]), l10))
         z[0] = merge_fft(ffnp_fft(split_fft(t0b), T0))
         return z
-    elif (n == 1):
-        z[0] = [round(t[0][0].real)]
-        z[1] = [round(t[1][0].real)]
+    elif (n == 2):
+        # Bottom of the recursion: each polynomial has a single FFT coefficient,
+        # whose real and imaginary parts are its two coefficients.
+        l10, T0, T1 = T
+        z[1] = [round(t[1][0].real) + 1j * round(t[1][0].imag)]
+        t0b = add_fft(t[0], mul_fft(sub_fft(t[1], z[1]), l10))
+        z[0] = [round(t0b[0].real) + 1j * round(t0b[0].imag)]
         return z
 
 
@@ -198,13 +204,240 @@ def ffsampling_fft(t, T, sigmin, randombytes):
     """
     n = len(t[0]) * fft_ratio
     z = [0, 0]
-    if (n > 1):
+    if (n > 2):
         l10, T0, T1 = T
         z[1] = merge_fft(ffsampling_fft(split_fft(t[1]), T1, sigmin, randombytes))
         t0b = add_fft(t[0], mul_fft(sub_fft(t[1], z[1]), l10))
         z[0] = merge_fft(ffsampling_fft(split_fft(t0b), T0, sigmin, randombytes))
         return z
-    elif (n == 1):
-        z[0] = [samplerz(t[0][0].real, T[0], sigmin, randombytes)]
-        z[1] = [samplerz(t[1][0].real, T[0], sigmin, randombytes)]
+    elif (n == 2):
+        # Bottom of the recursion: each polynomial has a single FFT coefficient,
+        # whose real and imaginary parts are its two coefficients.
+        # Splitting and merging thus amount to reading and writing these parts.
+        l10, T0, T1 = T
+        z10 = samplerz(t[1][0].real, T1[0], sigmin, randombytes)
+        z11 = samplerz(t[1][0].imag, T1[0], sigmin, randombytes)
+        z[1] = [z10 + 1j * z11]
+        t0b = add_fft(t[0], mul_fft(sub_fft(t[1], z[1]), l10))
+        z00 = samplerz(t0b[0].real, T0[0], sigmin, randombytes)
+        z01 = samplerz(t0b[0].imag, T0[0], sigmin, randombytes)
+        z[0] = [z00 + 1j * z01]
         return z
+
+
+"""
+Twiddle factors of split_fft and merge_fft, for polynomials of each degree m:
+merge_twiddles[m][i] = roots_dict[m][2 * i], and split_twiddles[m] holds their conjugates.
+Both are given as arrays, and as lists for the lower levels of ffsampling_flat.
+"""
+merge_twiddles = {}
+split_twiddles = {}
+for m in fft_twiddles:
+    merge_twiddles[m] = fft_twiddles[m][:len(fft_twiddles[m]) // 2]
+    split_twiddles[m] = merge_twiddles[m].conjugate()
+merge_twiddles_list = {m: merge_twiddles[m].tolist() for m in merge_twiddles}
+split_twiddles_list = {m: split_twiddles[m].tolist() for m in split_twiddles}
+
+# Number of FFT coefficients above which ffsampling_flat uses NumPy arrays
+FLAT_NUMPY_MIN = 16
+
+
+def ffldl_flat(G):
+    """Compute the ffLDL decomposition tree of G, in a flattened form.
+
+    Args:
+        G: a Gram matrix
+
+    Format: FFT
+
+    Returns [L, D], where:
+    - L is a complex array of shape (log2(n), n // 2). For each depth d, L[d]
+      stores the l10 of the 2 ** d nodes of depth d one after the other:
+      node k has n >> (d + 1) FFT coefficients and starts at index k * (n >> (d + 1)).
+      The children of node k are the nodes 2 * k (T0) and 2 * k + 1 (T1).
+    - D is a real array of shape (n,), where D[2 * k] and D[2 * k + 1]
+      are the leaves T0 and T1 of the node k of the last depth.
+
+    The tree is the same as the one of ffldl_fft, but computed level by level:
+    all the nodes of a depth are decomposed and split at once.
+    """
+    G = asarray(G, dtype=complex128)
+    hn = G.shape[-1]
+    depth = (2 * hn).bit_length() - 1
+    L = zeros((depth, hn), dtype=complex128)
+    # Entries of the Gram matrices of all the nodes of the current depth
+    g00, g10, g11 = G[0, 0][None], G[1, 0][None], G[1, 1][None]
+    for d in range(depth):
+        l10 = g10 / g00
+        d11 = g11 - (l10 * l10.conjugate()) * g00
+        L[d] = l10.ravel()
+        # The diagonals of the children 2 * k and 2 * k + 1 of node k
+        D = stack((g00, d11), axis=1).reshape(-1, hn)
+        if (hn == 1):
+            # End of the recursion (each element has a single FFT coefficient, which is real).
+            return [L, D.real.ravel()]
+        # A bisection is done on elements of a 2*2 diagonal matrix.
+        d0 = 0.5 * (D[:, 0::2] + D[:, 1::2])
+        d1 = 0.5 * (D[:, 0::2] - D[:, 1::2]) * split_twiddles[2 * hn]
+        g00, g10, g11 = d0, d1.conjugate(), d0
+        hn //= 2
+
+
+def flat_tree_lists(T):
+    """
+    Return the flattened tree T = [L, D] (see ffldl_flat) together with the
+    list forms of its arrays, as [L, D, L.tolist(), D.tolist()].
+    ffsampling_flat uses the list forms on the lower levels of the tree, so
+    they are computed once per key instead of once per sampling.
+    """
+    L, D = T[0], T[1]
+    return [L, D, L.tolist(), D.tolist()]
+
+
+# Scratch buffers of ffsampling_flat, private to each thread (see flat_workspace)
+workspaces = local()
+
+
+def flat_workspace(n):
+    """
+    Return the scratch buffers [t_buf, z_buf, f_buf, wz_buf] of ffsampling_flat
+    for polynomials of degree n. Each is indexed by depth, and only holds
+    arrays for the depths whose nodes have more than FLAT_NUMPY_MIN FFT
+    coefficients (the other depths use lists). The buffers are allocated once
+    per thread and per n, and reused by all the samplings of the thread, so
+    that threads signing with the same key never share them.
+    """
+    cache = getattr(workspaces, "cache", None)
+    if cache is None:
+        cache = workspaces.cache = {}
+    if n not in cache:
+        depth = n.bit_length() - 1
+        t_buf, z_buf, f_buf, wz_buf = [[None] * depth for i in range(4)]
+        for d in range(depth):
+            hn = n >> (d + 1)
+            if (hn > FLAT_NUMPY_MIN):
+                # Targets (t0, t1) and samples (z0, z1) of the current node of depth d
+                t_buf[d] = empty((2, hn), dtype=complex128)
+                z_buf[d] = [empty(hn, dtype=complex128), empty(hn, dtype=complex128)]
+                f_buf[d] = empty(hn, dtype=complex128)
+                wz_buf[d] = empty(hn // 2, dtype=complex128)
+        cache[n] = [t_buf, z_buf, f_buf, wz_buf]
+    return cache[n]
+
+
+def ffsampling_flat(t, T, sigmin, randombytes):
+    """Compute the ffsampling of t, using the flattened tree T as auxilary information.
+
+    Args:
+        t: a vector
+        T: a flattened ldl decomposition tree [L, D] (see ffldl_flat), with normalized leaves,
+           optionally with the list forms of L and D (see flat_tree_lists)
+
+    Format: FFT
+
+    This computes the same as ffsampling_fft, with the recursion unrolled:
+    the nodes are visited using an explicit stack, and each depth has a
+    target and a sample buffer, which are those of its current node.
+    Nodes with more than FLAT_NUMPY_MIN FFT coefficients work in place on
+    the NumPy arrays of flat_workspace, the others on lists, and the nodes
+    of 2 FFT coefficients handle their two children (leaves) directly.
+    """
+    L = T[0]
+    L_list, D = (T[2], T[3]) if (len(T) == 4) else (L.tolist(), T[1].tolist())
+    hn = len(t[0])
+    n = 2 * hn
+    t_buf, z_buf, f_buf, wz_buf = flat_workspace(n)
+    if (hn > FLAT_NUMPY_MIN):
+        t_buf[0][...] = t
+    else:
+        t_buf[0] = [list(t[0]), list(t[1])]
+    # Each item is (depth, index of the node, step): at step 0, the node
+    # samples its child T1; at step 1 its child T0, and at step 2 it is done.
+    nodes = [(0, 0, 0)]
+    while nodes:
+        d, k, step = nodes.pop()
+        hn = n >> (d + 1)
+        t0, t1 = t_buf[d]
+        if (hn == 1):
+            # Bottom of the recursion: each polynomial has a single FFT coefficient,
+            # whose real and imaginary parts are its two coefficients.
+            t1, l10 = t1[0], L_list[d][k]
+            z1 = samplerz(t1.real, D[2 * k + 1], sigmin, randombytes)
+            z1 += 1j * samplerz(t1.imag, D[2 * k + 1], sigmin, randombytes)
+            t0b = t0[0] + (t1 - z1) * l10
+            z0 = samplerz(t0b.real, D[2 * k], sigmin, randombytes)
+            z0 += 1j * samplerz(t0b.imag, D[2 * k], sigmin, randombytes)
+            z_buf[d] = [[z0], [z1]]
+        elif (hn == 2):
+            # The node and its two leaves, with split_fft and merge_fft inlined
+            z_buf[d] = [None, None]
+            w, wc = merge_twiddles_list[4][0], split_twiddles_list[4][0]
+            u0, u1 = t1
+            for child in [2 * k + 1, 2 * k]:
+                c0, c1 = 0.5 * (u0 + u1), 0.5 * (u0 - u1) * wc
+                y1 = samplerz(c1.real, D[2 * child + 1], sigmin, randombytes)
+                y1 += 1j * samplerz(c1.imag, D[2 * child + 1], sigmin, randombytes)
+                c0 += (c1 - y1) * L_list[d + 1][child]
+                y0 = samplerz(c0.real, D[2 * child], sigmin, randombytes)
+                y0 += 1j * samplerz(c0.imag, D[2 * child], sigmin, randombytes)
+                z = [y0 + w * y1, y0 - w * y1]
+                z_buf[d][child - 2 * k] = z
+                if (child & 1):
+                    l10 = L_list[d][2 * k: 2 * k + 2]
+                    u0 = t0[0] + (t1[0] - z[0]) * l10[0]
+                    u1 = t0[1] + (t1[1] - z[1]) * l10[1]
+        else:
+            m = 2 * hn
+            if (hn > FLAT_NUMPY_MIN):
+                if (step > 0):
+                    # The sample of T1 goes to z_buf[d][1], the one of T0 to z_buf[d][0]
+                    z0, z1 = z_buf[d + 1]
+                    z = z_buf[d][2 - step]
+                    wz = multiply(merge_twiddles[m], z1, out=wz_buf[d])
+                    add_arrays(z0, wz, out=z[0::2])
+                    subtract(z0, wz, out=z[1::2])
+                    if (step == 2):
+                        continue
+                    f = subtract(t1, z, out=f_buf[d])
+                    f *= L[d, k * hn:(k + 1) * hn]
+                    f += t0
+                else:
+                    f = t1
+                f_even, f_odd = f[0::2], f[1::2]
+                if (hn // 2 > FLAT_NUMPY_MIN):
+                    f0, f1 = t_buf[d + 1]
+                    add_arrays(f_even, f_odd, out=f0)
+                    f0 *= 0.5
+                    subtract(f_even, f_odd, out=f1)
+                    f1 *= 0.5
+                    f1 *= split_twiddles[m]
+                else:
+                    f0 = 0.5 * (f_even + f_odd)
+                    f1 = 0.5 * (f_even - f_odd) * split_twiddles[m]
+                    t_buf[d + 1] = [f0.tolist(), f1.tolist()]
+            else:
+                if (step > 0):
+                    z0, z1 = z_buf[d + 1]
+                    z = [0] * hn
+                    wz = [w * elt for (w, elt) in zip(merge_twiddles_list[m], z1)]
+                    z[0::2] = [a + b for (a, b) in zip(z0, wz)]
+                    z[1::2] = [a - b for (a, b) in zip(z0, wz)]
+                    if (step == 2):
+                        z_buf[d][0] = z
+                        continue
+                    z_buf[d] = [None, z]
+                    l10 = L_list[d][k * hn:(k + 1) * hn]
+                    f = [a + (b - c) * l for (a, b, c, l) in zip(t0, t1, z, l10)]
+                else:
+                    f = t1
+                f_even, f_odd = f[0::2], f[1::2]
+                f0 = [0.5 * (a + b) for (a, b) in zip(f_even, f_odd)]
+                f1 = [0.5 * (a - b) * w for (a, b, w) in zip(f_even, f_odd, split_twiddles_list[m])]
+                t_buf[d + 1] = [f0, f1]
+            # Resume this node once its child (T1 at step 0, T0 at step 1) is sampled
+            nodes.append((d, k, step + 1))
+            nodes.append((d + 1, 2 * k + 1 - step, 0))
+    if (n // 2 > FLAT_NUMPY_MIN):
+        # The buffers are reused by the next sampling of the thread
+        return [z_buf[0][0].copy(), z_buf[0][1].copy()]
+    return z_buf[0]
@@ -5,10 +5,19 @@ The FFT implemented here is for polynomials in R[x]/(phi), with:
 
 The code is voluntarily very similar to the code of the NTT.
 It is probably possible to use templating to merge both implementations.
+
+The transforms themselves (fft_batch, ifft_batch) are iterative and work
+on NumPy arrays, either a single polynomial or a batch of them.
+fft and ifft are thin wrappers over them, working on lists.
+
+Since the polynomials are real, the second half of the FFT coefficients
+are the conjugates of the first half. Hence only the first half is stored
+(a "short" FFT, see fft_ratio), and all the operations in FFT
+representation act on n // 2 complex coefficients.
 """
 
-from falcon.common import split, merge         # Import split and merge
 from falcon.fft_constants import roots_dict    # Import constants useful for the FFT
+from numpy import array, asarray, stack, concatenate, complex128, float64  # FFT engine
 
 
 def split_fft(f_fft):
@@ -20,12 +29,14 @@ def split_fft(f_fft):
     Format: FFT
 
     Corresponds to algorithm 1 (splitfft_2) of Falcon's documentation.
+    Only works for n >= 4, see ffsampling_fft for the case n = 2.
     """
-    n = len(f_fft)
+    n = len(f_fft) * fft_ratio
     w = roots_dict[n]
-    f0_fft = [0] * (n // 2)
-    f1_fft = [0] * (n // 2)
-    for i in range(n // 2):
+    hn = len(f_fft) // 2
+    f0_fft = [0] * hn
+    f1_fft = [0] * hn
+    for i in range(hn):
         f0_fft[i] = 0.5 * (f_fft[2 * i] + f_fft[2 * i + 1])
         f1_fft[i] = 0.5 * (f_fft[2 * i] - f_fft[2 * i + 1]) * w[2 * i].conjugate()
     return [f0_fft, f1_fft]
@@ -40,17 +51,95 @@ def merge_fft(f_list_fft):
     Format: FFT
 
     Corresponds to algorithm 2 (mergefft_2) of Falcon's documentation.
+    Only works for n >= 4, see ffsampling_fft for the case n = 2.
     """
     f0_fft, f1_fft = f_list_fft
-    n = 2 * len(f0_fft)
+    n = 2 * len(f0_fft) * fft_ratio
     w = roots_dict[n]
-    f_fft = [0] * n
-    for i in range(n // 2):
+    hn = len(f0_fft)
+    f_fft = [0] * (2 * hn)
+    for i in range(hn):
         f_fft[2 * i + 0] = f0_fft[i] + w[2 * i] * f1_fft[i]
         f_fft[2 * i + 1] = f0_fft[i] - w[2 * i] * f1_fft[i]
     return f_fft
 
 
+"""
+Twiddle tables used by fft_batch and ifft_batch, for each n in roots_dict.
+In Falcon's ordering of the roots, roots_dict[n][2 * i + 1] = - roots_dict[n][2 * i],
+so only the even-indexed roots are needed:
+- fft_twiddles[n] holds the roots w = roots_dict[n][0::2]
+- ifft_twiddles[n] holds their conjugates
+"""
+fft_twiddles = {}
+ifft_twiddles = {}
+for deg in roots_dict:
+    fft_twiddles[deg] = array(roots_dict[deg][0::2], dtype=complex128)
+    ifft_twiddles[deg] = fft_twiddles[deg].conjugate()
+
+
+def fft_batch(f):
+    """Compute the FFT of a polynomial or of a batch of polynomials mod (x ** n + 1).
+
+    Args:
+        f: an array of shape (n,) or (..., n), each row being a polynomial
+
+    Format: input as coefficients, output as FFT (a complex128 array of shape (..., n // 2))
+
+    This is the iterative counterpart of the recursive split / merge_fft
+    approach: all the sub-polynomials of a level are stored in a single
+    array of shape (..., n // (2 * hn), hn), and merged at once.
+    Only the first half of the FFT coefficients is computed.
+    """
+    f = asarray(f, dtype=complex128)
+    shape = f.shape
+    n = shape[-1]
+    # Sub-polynomials of degree 2: f[r] + f[r + n // 2] * x evaluates to
+    # f[r] + 1j * f[r + n // 2] at the first root of x ** 2 + 1
+    f_fft = f[..., :n // 2] + 1j * f[..., n // 2:]
+    f_fft = f_fft.reshape(shape[:-1] + (n // 2, 1))
+    # At each level, f_fft[..., r, :] is the short FFT (of length hn)
+    # of the sub-polynomial made of the coefficients f[r::n // (2 * hn)]
+    hn = 1
+    while 2 * hn < n:
+        s = n // (4 * hn)
+        f0_fft = f_fft[..., :s, :]
+        f1_fft = f_fft[..., s:, :]
+        t = fft_twiddles[4 * hn][:hn] * f1_fft
+        f_fft = stack((f0_fft + t, f0_fft - t), axis=-1)
+        f_fft = f_fft.reshape(shape[:-1] + (s, 2 * hn))
+        hn *= 2
+    return f_fft.reshape(shape[:-1] + (n // 2,))
+
+
+def ifft_batch(f_fft):
+    """Compute the inverse FFT of a polynomial or of a batch of polynomials mod (x ** n + 1).
+
+    Args:
+        f_fft: an array of shape (n // 2,) or (..., n // 2), each row being a FFT
+
+    Format: input as FFT, output as coefficients (a float64 array of shape (..., n))
+
+    This undoes the levels of fft_batch in reverse order.
+    """
+    f_fft = asarray(f_fft, dtype=complex128)
+    shape = f_fft.shape
+    n = 2 * shape[-1]
+    f = f_fft.reshape(shape[:-1] + (1, n // 2))
+    hn = n // 4
+    while hn >= 1:
+        even = f[..., 0::2]
+        odd = f[..., 1::2]
+        f0 = 0.5 * (even + odd)
+        f1 = (0.5 * (even - odd)) * ifft_twiddles[4 * hn][:hn]
+        f = concatenate((f0, f1), axis=-2)
+        hn //= 2
+    # Bottom of the recursion: a polynomial f0 + f1 * x mod (x ** 2 + 1)
+    # is read from its FFT coefficient f0 + 1j * f1.
+    f = concatenate((f[..., 0].real, f[..., 0].imag), axis=-1)
+    return f.astype(float64).reshape(shape[:-1] + (n,))
+
+
 def fft(f):
     """Compute the FFT of a polynomial mod (x ** n + 1).
 
@@ -59,17 +148,7 @@ def fft(f):
 
     Format: input as coefficients, output as FFT
     """
-    n = len(f)
-    if (n > 2):
-        f0, f1 = split(f)
-        f0_fft = fft(f0)
-        f1_fft = fft(f1)
-        f_fft = merge_fft([f0_fft, f1_fft])
-    elif (n == 2):
-        f_fft = [0] * n
-        f_fft[0] = f[0] + 1j * f[1]
-        f_fft[1] = f[0] - 1j * f[1]
-    return f_fft
+    return fft_batch(f).tolist()
 
 
 def ifft(f_fft):
@@ -80,17 +159,7 @@ def ifft(f_fft):
 
     Format: input as FFT, output as coefficients
     """
-    n = len(f_fft)
-    if (n > 2):
-        f0_fft, f1_fft = split_fft(f_fft)
-        f0 = ifft(f0_fft)
-        f1 = ifft(f1_fft)
-        f = merge([f0, f1])
-    elif (n == 2):
-        f = [0] * n
-        f[0] = f_fft[0].real
-        f[1] = f_fft[0].imag
-    return f
+    return ifft_batch(f_fft).tolist()
 
 
 def add(f, g):
@@ -113,17 +182,17 @@ def sub(f, g):
 
 def mul(f, g):
     """Multiplication of two polynomials (coefficient representation)."""
-    return ifft(mul_fft(fft(f), fft(g)))
+    return ifft_batch(fft_batch(f) * fft_batch(g)).tolist()
 
 
 def div(f, g):
     """Division of two polynomials (coefficient representation)."""
-    return ifft(div_fft(fft(f), fft(g)))
+    return ifft_batch(fft_batch(f) / fft_batch(g)).tolist()
 
 
 def adj(f):
     """Ajoint of a polynomial (coefficient representation)."""
-    return ifft(adj_fft(fft(f)))
+    return ifft_batch(fft_batch(f).conjugate()).tolist()
 
 
 def add_fft(f_fft, g_fft):
@@ -157,7 +226,7 @@ def adj_fft(f_fft):
 
 """This value is the ratio between:
     - The degree n
-    - The number of complex coefficients of the NTT
-While here this ratio is 1, it is possible to develop a short NTT such that it is 2.
+    - The number of complex coefficients of the FFT
+Here this ratio is 2, as only the first half of the FFT coefficients is stored.
 """
-fft_ratio = 1
+fft_ratio = 2
@@ -0,0 +1,104 @@
+"""
+Parallel generation of the NTRU polynomials of secret keys.
+
+ntru_gen rejects many candidates (f, g) before it finds one for which
+the NTRU equation can be solved, and each candidate takes a while.
+A KeygenPool runs ntru_gen in several processes:
+- ntru_gen runs the same search in all the processes, returns the first
+  result and stops the other searches (speculative key generation),
+  which lowers the latency of a single key and its variance;
+- ntru_gen_bulk generates many keys, with all the processes.
+
+The polynomials are returned as [f, g, F, G], to be used as
+SecretKey(n, polys).
+"""
+from falcon.ntrugen import ntru_gen
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import Event
+from os import cpu_count
+
+
+# Event shared by the processes of a KeygenPool, set to stop their searches
+stop_event = None
+
+
+def init_worker(event):
+    """Initialize a process of a KeygenPool."""
+    global stop_event
+    stop_event = event
+
+
+def search(n):
+    """Run ntru_gen in a process of a KeygenPool, until it is stopped."""
+    return ntru_gen(n, stop_event)
+
+
+def generate(n):
+    """Run ntru_gen in a process of a KeygenPool, without interruption."""
+    return ntru_gen(n)
+
+
+class KeygenPool:
+    """
+    A pool of processes generating NTRU polynomials.
+    It should be closed after use, e.g. with a with statement.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Start a pool of workers processes (default: one per CPU).
+        """
+        self.workers = cpu_count() if workers is None else workers
+        self.stop = Event()
+        self.executor = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.stop,))
+        # Searches of the previous call of ntru_gen that are still running
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def drain(self):
+        """Wait for the stopped searches of the previous call of ntru_gen."""
+        wait(self.pending)
+        self.pending = []
+        self.stop.clear()
+
+    def ntru_gen(self, n):
+        """
+        Return the polynomials [f, g, F, G] of the first of workers
+        independent searches to succeed, and stop the other searches.
+        Raise a RuntimeError if all the searches are stopped before one
+        succeeds, e.g. because the pool is closed concurrently.
+        """
+        self.drain()
+        futures = [self.executor.submit(search, n) for i in range(self.workers)]
+        while True:
+            done, running = wait(futures, return_when=FIRST_COMPLETED)
+            results = [future.result() for future in done]
+            results = [result for result in results if result is not None]
+            if results:
+                break
+            if not running:
+                raise RuntimeError("All the key generation searches were stopped")
+            futures = running
+        # The other searches stop after their current candidate. They are
+        # not waited for here, but before the next search.
+        self.stop.set()
+        self.pending = list(running)
+        return list(results[0])
+
+    def ntru_gen_bulk(self, n, count):
+        """
+        Return a list of count lists of polynomials [f, g, F, G],
+        generated by all the processes of the pool.
+        """
+        self.drain()
+        return [list(polys) for polys in self.executor.map(generate, [n] * count)]
+
+    def close(self):
+        """Stop all the searches and shut down the processes."""
+        self.stop.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
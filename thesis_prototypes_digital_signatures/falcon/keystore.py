@@ -0,0 +1,140 @@
+"""
+Persistence of expanded secret keys.
+
+Expanding a secret key (B0_fft, the ffLDL tree, h) costs much more than
+reading it, so a signer can save its expanded keys once with save_keys,
+and later load them with load_keys without any recomputation.
+
+A key file starts with a 32-byte header:
+- the magic bytes MAGIC (8 bytes)
+- the format VERSION (2 bytes, little-endian)
+- logn (1 byte) and the length of the XOF name (1 byte)
+- the number of keys (4 bytes, little-endian)
+- the XOF name of the keys, zero-padded (16 bytes)
+
+It is followed by one record per key. A record is a CRC-32 of its payload
+(4 bytes, little-endian), 4 zero bytes, then the payload: the arrays listed
+in record_layout(n), in this order, in little-endian byte order.
+
+load_keys maps the file in memory: the arrays of the loaded keys are
+read-only views of the file, and are not copied.
+"""
+from falcon.falcon import SecretKey, logn
+from numpy import asarray, frombuffer, dtype
+from math import prod
+from mmap import mmap, ACCESS_READ
+from os import fdopen, fsync, remove, replace
+from os.path import abspath, dirname
+from tempfile import mkstemp
+from struct import Struct
+from zlib import crc32
+
+
+MAGIC = b"FALCONSK"
+VERSION = 1
+HEADER = Struct("<8sHBBI16s")
+RECORD_HEADER = Struct("<II")
+
+
+def record_layout(n):
+    """
+    Return the arrays of a record for a key of degree n,
+    as a list of (name, dtype, shape).
+    """
+    depth = logn[n]
+    return [
+        ("f", dtype("<i4"), (n,)),
+        ("g", dtype("<i4"), (n,)),
+        ("F", dtype("<i4"), (n,)),
+        ("G", dtype("<i4"), (n,)),
+        ("h", dtype("<i4"), (n,)),
+        ("h_ntt", dtype("<i4"), (n,)),
+        ("B0_fft", dtype("<c16"), (2, 2, n // 2)),
+        ("T_l10", dtype("<c16"), (depth, n // 2)),
+        ("T_leaves", dtype("<f8"), (n,))
+    ]
+
+
+def record_size(n):
+    """Return the bytelength of the payload of a record for a key of degree n."""
+    return sum(elt_type.itemsize * prod(shape) for (name, elt_type, shape) in record_layout(n))
+
+
+def save_keys(path, keys):
+    """
+    Save a non-empty list of secret keys in a key file at path.
+    All the keys MUST share the same n and the same XOF.
+
+    The key file is only readable by its owner. It is written to a temporary
+    file in the same directory, then renamed to path, so that path always
+    holds either its previous content or the complete key file.
+    Raise a ValueError if keys is empty.
+    """
+    if (len(keys) == 0):
+        raise ValueError("No key to save")
+    n, xof = keys[0].n, keys[0].xof
+    assert all((sk.n == n) and (sk.xof == xof) for sk in keys)
+    # mkstemp creates the file with mode 0o600
+    descriptor, temp_path = mkstemp(dir=dirname(abspath(path)), prefix=".keys-")
+    try:
+        with fdopen(descriptor, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, logn[n], len(xof), len(keys), xof.encode()))
+            for sk in keys:
+                fields = {
+                    "f": sk.f, "g": sk.g, "F": sk.F, "G": sk.G,
+                    "h": sk.h, "h_ntt": sk.h_ntt, "B0_fft": sk.B0_fft,
+                    "T_l10": sk.T_fft[0], "T_leaves": sk.T_fft[1]
+                }
+                payload = b"".join(asarray(fields[name], dtype=elt_type).tobytes()
+                                   for (name, elt_type, shape) in record_layout(n))
+                file.write(RECORD_HEADER.pack(crc32(payload), 0))
+                file.write(payload)
+            file.flush()
+            fsync(file.fileno())
+        replace(temp_path, path)
+    except BaseException:
+        remove(temp_path)
+        raise
+
+
+def load_keys(path):
+    """
+    Load the list of secret keys saved in the key file at path.
+    Raise a ValueError if the file is not a valid key file.
+    """
+    with open(path, "rb") as file:
+        # The mapping stays valid after the file is closed
+        data = mmap(file.fileno(), 0, access=ACCESS_READ)
+    if len(data) < HEADER.size:
+        raise ValueError("Invalid key file header")
+    magic, version, logn_key, xof_len, count, xof = HEADER.unpack_from(data, 0)
+    if (magic != MAGIC):
+        raise ValueError("Invalid key file header")
+    if (version != VERSION):
+        raise ValueError("Unsupported key file version: {version}".format(version=version))
+    n = 1 << logn_key
+    if (n not in logn) or (xof_len > len(xof)):
+        raise ValueError("Invalid key file header")
+    xof = xof[:xof_len].decode()
+    size = record_size(n)
+    if (len(data) != HEADER.size + count * (RECORD_HEADER.size + size)):
+        raise ValueError("Invalid key file length")
+
+    keys = []
+    offset = HEADER.size
+    view = memoryview(data)
+    for i in range(count):
+        checksum, reserved = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        payload = view[offset:offset + size]
+        if (crc32(payload) != checksum) or (reserved != 0):
+            raise ValueError("Invalid checksum for key {i}".format(i=i))
+        fields = {}
+        for (name, elt_type, shape) in record_layout(n):
+            fields[name] = frombuffer(data, dtype=elt_type, count=prod(shape), offset=offset).reshape(shape)
+            offset += elt_type.itemsize * prod(shape)
+        polys = [fields[name].tolist() for name in ["f", "g", "F", "G"]]
+        T_fft = [fields["T_l10"], fields["T_leaves"]]
+        expanded = [fields["h"].tolist(), fields["h_ntt"].tolist(), fields["B0_fft"], T_fft]
+        keys += [SecretKey(n, polys, xof, expanded)]
+    return keys
@@ -1,11 +1,15 @@
 """
 This file implements the section 3.8.2 of Falcon's documentation.
 """
-from falcon.fft import fft, ifft, add_fft, mul_fft, adj_fft, div_fft
-from falcon.fft import add, mul, div, adj
+from falcon.fft import fft, ifft, fft_batch, add_fft, mul_fft, adj_fft, div_fft
 from falcon.ntt import ntt
 from falcon.common import sqnorm
-from falcon.samplerz import samplerz
+from numpy import array, frombuffer, searchsorted, uint64
+from math import ceil
+from decimal import Decimal, localcontext
+from itertools import accumulate
+from os import urandom
+from timeit import default_timer as timer
 
 
 q = 12 * 1024 + 1
@@ -39,14 +43,73 @@ def karatsuba(a, b, n):
         return ab
 
 
-def karamul(a, b):
+def kronecker_width(a, b):
+    """
+    Return the bytelength w of the slots used by kronecker_mul for a * b:
+    each coefficient of a, b and a * b mod (x ** n + 1), plus an offset
+    2 ** (8 * w - 1) making it nonnegative, fits in 8 * w bits.
+    """
+    bound_a = max(abs(min(a)), max(a))
+    bound_b = max(abs(min(b)), max(b))
+    bound = max(bound_a * bound_b * len(a), bound_a, bound_b)
+    return (bound.bit_length() + 2 + 7) >> 3
+
+
+def kronecker_pack(a, w):
+    """
+    Pack a polynomial with integer coefficients into the integer a(2 ** (8 * w)),
+    for coefficients of absolute value less than 2 ** (8 * w - 1).
     """
-    Karatsuba multiplication, followed by reduction mod (x ** n + 1).
+    half = 1 << (8 * w - 1)
+    # The coefficients are offset by half so that they can be written
+    # as unsigned bytes, and the offset is removed from the packed integer.
+    offset = int.from_bytes(half.to_bytes(w, "little") * len(a), "little")
+    packed = b"".join((coef + half).to_bytes(w, "little") for coef in a)
+    return int.from_bytes(packed, "little") - offset
+
+
+def kronecker_unpack(x, n, w):
+    """
+    Unpack the n coefficients of a polynomial packed by kronecker_pack.
+    """
+    half = 1 << (8 * w - 1)
+    offset = int.from_bytes(half.to_bytes(w, "little") * n, "little")
+    packed = (x + offset).to_bytes(n * w, "little")
+    return [int.from_bytes(packed[i:i + w], "little") - half for i in range(0, n * w, w)]
+
+
+def kronecker_mul(a, b):
+    """
+    Multiplication between polynomials with integer coefficients,
+    followed by reduction mod (x ** n + 1).
+
+    This is Kronecker substitution: both polynomials are evaluated at a
+    large power of two X, the evaluations are multiplied by CPython's big
+    integer multiplication (Karatsuba on machine words), and the product is
+    read back in base X. The reduction mod (x ** n + 1) is performed on the
+    integer, as a reduction mod (X ** n + 1).
     """
     n = len(a)
-    ab = karatsuba(a, b, n)
-    abr = [ab[i] - ab[i + n] for i in range(n)]
-    return abr
+    w = kronecker_width(a, b)
+    ab = kronecker_pack(a, w) * kronecker_pack(b, w)
+    # ab mod (X ** n + 1), centered, is the packing of a * b mod (x ** n + 1)
+    modulus = (1 << (8 * w * n)) + 1
+    abr = ((ab & (modulus - 2)) - (ab >> (8 * w * n))) % modulus
+    if abr > (modulus >> 1):
+        abr -= modulus
+    return kronecker_unpack(abr, n, w)
+
+
+def karamul(a, b):
+    """
+    Multiplication between polynomials with integer coefficients,
+    followed by reduction mod (x ** n + 1).
+
+    The multiplication was a Karatsuba multiplication (see karatsuba),
+    it is now performed by Kronecker substitution (see kronecker_mul),
+    which is much faster on the large coefficients of ntru_solve.
+    """
+    return kronecker_mul(a, b)
 
 
 def galois_conjugate(a):
@@ -101,21 +164,26 @@ def bitsize(a):
     return res
 
 
-def reduce(f, g, F, G):
+def reduce(f, g, F, G, fg_fft=None):
     """
     Reduce (F, G) relatively to (f, g).
 
     This is done via Babai's reduction.
     (F, G) <-- (F, G) - k * (f, g), where k = round((F f* + G g*) / (f f* + g g*)).
     Corresponds to algorithm 7 (Reduce) of Falcon's documentation.
+    Optionally, one can provide fg_fft = fft_batch([f, g]).
     """
     n = len(f)
     size = max(53, bitsize(min(f)), bitsize(max(f)), bitsize(min(g)), bitsize(max(g)))
 
-    f_adjust = [elt >> (size - 53) for elt in f]
-    g_adjust = [elt >> (size - 53) for elt in g]
-    fa_fft = fft(f_adjust)
-    ga_fft = fft(g_adjust)
+    if (fg_fft is not None) and (size == 53):
+        # f and g are not shifted, so their FFTs are already known
+        fa_fft, ga_fft = fg_fft.tolist()
+    else:
+        f_adjust = [elt >> (size - 53) for elt in f]
+        g_adjust = [elt >> (size - 53) for elt in g]
+        fa_fft = fft(f_adjust)
+        ga_fft = fft(g_adjust)
 
     while(1):
         # Because we work in finite precision to reduce very large polynomials,
@@ -136,12 +204,9 @@ def reduce(f, g, F, G):
         k = [int(round(elt)) for elt in k]
         if all(elt == 0 for elt in k):
             break
-        # The two next lines are the costliest operations in ntru_gen
-        # (more than 75% of the total cost in dimension n = 1024).
-        # There are at least two ways to make them faster:
-        # - replace Karatsuba with Toom-Cook
-        # - mutualized Karatsuba, see ia.cr/2020/268
-        # For simplicity reasons, we didn't implement these optimisations here.
+        # The two next lines were the costliest operations in ntru_gen
+        # (more than 75% of the total cost in dimension n = 1024) with
+        # Karatsuba. They now use Kronecker substitution, see kronecker_mul.
         fk = karamul(f, k)
         gk = karamul(g, k)
         for i in range(n):
@@ -163,10 +228,11 @@ def xgcd(b, n):
     return b, x0, y0
 
 
-def ntru_solve(f, g):
+def ntru_solve(f, g, fg_fft=None):
     """
     Solve the NTRU equation for f and g.
     Corresponds to NTRUSolve in Falcon's documentation.
+    Optionally, one can provide fg_fft = fft_batch([f, g]).
     """
     n = len(f)
     if n == 1:
@@ -183,63 +249,186 @@ def ntru_solve(f, g):
         Fp, Gp = ntru_solve(fp, gp)
         F = karamul(lift(Fp), galois_conjugate(g))
         G = karamul(lift(Gp), galois_conjugate(f))
-        F, G = reduce(f, g, F, G)
+        F, G = reduce(f, g, F, G, fg_fft)
         return F, G
 
 
-def gs_norm(f, g, q):
+def gs_norm(f, g, q, fg_fft=None):
     """
     Compute the squared Gram-Schmidt norm of the NTRU matrix generated by f, g.
     This matrix is [[g, - f], [G, - F]].
     This algorithm is equivalent to line 9 of algorithm 5 (NTRUGen).
+    Optionally, one can provide fg_fft = fft_batch([f, g]).
     """
     sqnorm_fg = sqnorm([f, g])
-    ffgg = add(mul(f, adj(f)), mul(g, adj(g)))
-    Ft = div(adj(g), ffgg)
-    Gt = div(adj(f), ffgg)
-    sqnorm_FG = (q ** 2) * sqnorm([Ft, Gt])
+    if fg_fft is None:
+        fg_fft = fft_batch([f, g])
+    # (Ft, Gt) = q * (adj(g), adj(f)) / (f * adj(f) + g * adj(g)) is not
+    # computed: by Parseval's identity, the squared norm of a polynomial
+    # is 2 / n times the sum of the squared moduli of its (short) FFT, so
+    # sqnorm([Ft, Gt]) = (2 / n) * sum(1 / (|f_fft| ** 2 + |g_fft| ** 2)).
+    ffgg = (fg_fft.real ** 2 + fg_fft.imag ** 2).sum(axis=0)
+    sqnorm_FG = (q ** 2) * (2 / len(f)) * float((1 / ffgg).sum())
     return max(sqnorm_fg, sqnorm_FG)
 
 
-def gen_poly(n):
+# Standard deviation of the samples summed by gen_poly: 1.17 * sqrt(12289 / 8192)
+SIGMA_FG = 1.43300980528773
+# The samples are restricted to [-TAILCUT * SIGMA_FG, TAILCUT * SIGMA_FG]
+TAILCUT = 13
+# Cumulative distribution tables of the coefficients of gen_poly(n), by n
+cdt_fg = dict()
+# Precision, in bits, of the fixed-point probabilities computed by make_cdt_fg
+CDT_PREC = 96
+
+
+def make_cdt_fg(n):
+    """
+    Return the cumulative distribution table (CDT) of a sum of k = 4096 / n
+    samples of D_{Z, 0, SIGMA_FG}, as an array of 63-bit integers,
+    and the smallest value of the sum.
+
+    The table is computed in integer arithmetic: the probabilities of
+    D_{Z, 0, SIGMA_FG} are rounded to CDT_PREC bits, the distribution of
+    the sum is a convolution power of them, computed exactly and rounded
+    back to CDT_PREC bits after each convolution, and the cumulative sums
+    are rounded to 63 bits. All 63 bits of each entry are significant,
+    which a float64 computation (53 bits) would not give.
+    """
+    zmax = int(ceil(TAILCUT * SIGMA_FG))
+    with localcontext() as context:
+        context.prec = 50
+        sigma = Decimal(SIGMA_FG)
+        rho = [(- Decimal(z * z) / (2 * sigma * sigma)).exp() for z in range(-zmax, zmax + 1)]
+        total = sum(rho)
+        pdt = [int((r * (1 << CDT_PREC) / total).to_integral_value()) for r in rho]
+    # The distribution of a sum of samples is a convolution power.
+    # Since k is a power of two, it is computed by successive squarings,
+    # each being a single big integer product (see kronecker_pack).
+    k = 4096 // n
+    while k > 1:
+        size = len(pdt)
+        w = (2 * CDT_PREC + size.bit_length()) // 8 + 2
+        square = kronecker_unpack(kronecker_pack(pdt, w) ** 2, 2 * size - 1, w)
+        pdt = [(coef + (1 << (CDT_PREC - 1))) >> CDT_PREC for coef in square]
+        k >>= 1
+    cum = list(accumulate(pdt))
+    total = cum[-1]
+    cdt = array([((elt << 63) + (total >> 1)) // total for elt in cum], dtype=uint64)
+    return cdt, - zmax * (4096 // n)
+
+
+def gen_poly(n, randombytes=urandom):
     """
     Generate a polynomial of degree at most (n - 1), with coefficients
     following a discrete Gaussian distribution D_{Z, 0, sigma_fg} with
     sigma_fg = 1.17 * sqrt(q / (2 * n)).
+
+    Each coefficient is a sum of 4096 / n samples of D_{Z, 0, SIGMA_FG},
+    as in the reference implementation. Since this distribution is fixed,
+    it is tabulated (see make_cdt_fg), and each coefficient is sampled
+    with a lookup in the table, from 63 random bits.
     """
-    # 1.17 * sqrt(12289 / 8192)
-    sigma = 1.43300980528773
     assert(n < 4096)
-    f0 = [samplerz(0, sigma, sigma - 0.001) for _ in range(4096)]
-    f = [0] * n
-    k = 4096 // n
-    for i in range(n):
-        # We use the fact that adding k Gaussian samples of std. dev. sigma
-        # gives a Gaussian sample of std. dev. sqrt(k) * sigma.
-        f[i] = sum(f0[i * k + j] for j in range(k))
-    return f
+    if n not in cdt_fg:
+        cdt_fg[n] = make_cdt_fg(n)
+    cdt, zmin = cdt_fg[n]
+    u = frombuffer(randombytes(8 * n), dtype="<u8") >> uint64(1)
+    f = searchsorted(cdt, u, side="right") + zmin
+    return f.tolist()
+
+
+class NtruGenStats:
+    """
+    Counters of ntru_gen: the number of candidates (f, g) tried, of keys
+    generated, of rejections at each stage, and the time spent in each stage.
+    Each process has its own ntru_gen_stats, which ntru_gen uses by default.
+    """
+
+    # Stages of ntru_gen, in order. All but "sample" may reject a candidate.
+    STAGES = ["sample", "norm_fg", "gs_norm", "ntt", "solve"]
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Reset the counters."""
+        self.candidates = 0
+        self.keys = 0
+        self.rejections = {stage: 0 for stage in self.STAGES[1:]}
+        self.time = {stage: 0. for stage in self.STAGES}
+
+    def record(self, stage, start, rejected=False):
+        """
+        Add the time elapsed since start to a stage, and count
+        a rejection if rejected. Return the current time.
+        """
+        now = timer()
+        self.time[stage] += now - start
+        if rejected:
+            self.rejections[stage] += 1
+        return now
 
+    def __repr__(self):
+        """Print the counters in readable form."""
+        rep = "{keys} keys, {candidates} candidates\n".format(keys=self.keys, candidates=self.candidates)
+        for stage in self.STAGES:
+            rejections = self.rejections.get(stage, "-")
+            rep += "{stage}".format(stage=stage).ljust(10)
+            rep += "{rejections} rejections".format(rejections=rejections).rjust(18)
+            rep += "{ms} ms".format(ms=round(self.time[stage] * 1000, 1)).rjust(16) + "\n"
+        return rep
 
-def ntru_gen(n):
+
+ntru_gen_stats = NtruGenStats()
+
+
+def ntru_gen(n, stop=None, stats=None):
     """
     Implement the algorithm 5 (NTRUGen) of Falcon's documentation.
     At the end of the function, polynomials f, g, F, G in Z[x]/(x ** n + 1)
     are output, which verify f * G - g * F = q mod (x ** n + 1).
+    Optionally, stop is an event: once it is set, the function returns
+    None instead of trying another candidate (see falcon.keygen).
+    The counters are recorded in stats (default: ntru_gen_stats).
+
+    A candidate (f, g) goes through stages of increasing cost, and each
+    stage only runs on the candidates accepted by the previous ones.
+    The FFTs of f and g are computed once, and reused by ntru_solve.
     """
+    stats = ntru_gen_stats if stats is None else stats
     while True:
+        if (stop is not None) and stop.is_set():
+            return None
+        stats.candidates += 1
+        start = timer()
         f = gen_poly(n)
         g = gen_poly(n)
-        if gs_norm(f, g, q) > (1.17 ** 2) * q:
+        start = stats.record("sample", start)
+        # The squared norm of (f, g) is a lower bound of gs_norm
+        if sqnorm([f, g]) > (1.17 ** 2) * q:
+            stats.record("norm_fg", start, rejected=True)
+            continue
+        start = stats.record("norm_fg", start)
+        fg_fft = fft_batch([f, g])
+        if gs_norm(f, g, q, fg_fft) > (1.17 ** 2) * q:
+            stats.record("gs_norm", start, rejected=True)
             continue
+        start = stats.record("gs_norm", start)
         f_ntt = ntt(f)
         if any((elem == 0) for elem in f_ntt):
+            stats.record("ntt", start, rejected=True)
             continue
+        start = stats.record("ntt", start)
         try:
-            F, G = ntru_solve(f, g)
+            F, G = ntru_solve(f, g, fg_fft)
             F = [int(coef) for coef in F]
             G = [int(coef) for coef in G]
+            stats.record("solve", start)
+            stats.keys += 1
             return f, g, F, G
         # If the NTRU equation cannot be solved, a ValueError is raised
         # In this case, we start again
         except ValueError:
+            stats.record("solve", start, rejected=True)
             continue
@@ -6,9 +6,14 @@ The NTT implemented here is for polynomials in Z_q[x]/(phi), with:
 
 The code is voluntarily very similar to the code of the FFT.
 It is probably possible to use templating to merge both implementations.
+
+The transforms themselves (ntt_batch, intt_batch) are iterative and work
+on NumPy int64 arrays, either a single polynomial or a batch of them.
+ntt and intt are thin wrappers over them, working on lists.
 """
-from falcon.common import split, merge, q                     # Import split and merge
+from falcon.common import q                                   # Import the modulus
 from falcon.ntt_constants import roots_dict_Zq, inv_mod_q     # Import constants useful for the FFT
+from numpy import array, asarray, stack, concatenate, int64  # NTT engine
 
 
 """i2 is the inverse of 2 mod q."""
@@ -55,6 +60,79 @@ def merge_ntt(f_list_ntt):
     return f_ntt
 
 
+"""
+Twiddle tables used by ntt_batch and intt_batch, for each n in roots_dict_Zq.
+In Falcon's ordering of the roots, roots_dict_Zq[n][2 * i + 1] = - roots_dict_Zq[n][2 * i],
+so only the even-indexed roots are needed (this is a bit-reversed ordering):
+- ntt_twiddles[n] holds the roots w = roots_dict_Zq[n][0::2]
+- intt_twiddles[n] holds the values i2 * w^(-1) mod q
+"""
+ntt_twiddles = {}
+intt_twiddles = {}
+for deg in roots_dict_Zq:
+    ntt_twiddles[deg] = array(roots_dict_Zq[deg][0::2], dtype=int64)
+    intt_twiddles[deg] = array([(i2 * inv_mod_q[w]) % q for w in roots_dict_Zq[deg][0::2]], dtype=int64)
+
+"""inv_mod_q as an array, for vectorized lookups."""
+inv_mod_q_array = array(inv_mod_q, dtype=int64)
+
+
+def ntt_batch(f):
+    """Compute the NTT of a polynomial or of a batch of polynomials.
+
+    Args:
+        f: an integer array of shape (n,) or (..., n), each row being a polynomial
+
+    Format: input as coefficients, output as NTT (an int64 array)
+
+    This is the iterative counterpart of the recursive split / merge_ntt
+    approach: all the sub-polynomials of a level are stored in a single
+    array of shape (..., n // m, m), and merged at once. The output is
+    bit-exact with the recursive algorithm.
+    """
+    f = asarray(f, dtype=int64) % q
+    shape = f.shape
+    n = shape[-1]
+    # At each level, f_ntt[..., r, :] is the NTT of size m of the
+    # sub-polynomial made of the coefficients f[r::n // m]
+    f_ntt = f.reshape(shape + (1,))
+    m = 1
+    while m < n:
+        s = n // (2 * m)
+        f0_ntt = f_ntt[..., :s, :]
+        f1_ntt = f_ntt[..., s:, :]
+        t = (ntt_twiddles[2 * m] * f1_ntt) % q
+        f_ntt = stack(((f0_ntt + t) % q, (f0_ntt - t) % q), axis=-1)
+        f_ntt = f_ntt.reshape(shape[:-1] + (s, 2 * m))
+        m *= 2
+    return f_ntt.reshape(shape)
+
+
+def intt_batch(f_ntt):
+    """Compute the inverse NTT of a polynomial or of a batch of polynomials.
+
+    Args:
+        f_ntt: an integer array of shape (n,) or (..., n), each row being a NTT
+
+    Format: input as NTT, output as coefficients (an int64 array)
+
+    This undoes the levels of ntt_batch in reverse order.
+    """
+    f_ntt = asarray(f_ntt, dtype=int64) % q
+    shape = f_ntt.shape
+    n = shape[-1]
+    f = f_ntt.reshape(shape[:-1] + (1, n))
+    m = n // 2
+    while m >= 1:
+        even = f[..., 0::2]
+        odd = f[..., 1::2]
+        f0 = (i2 * (even + odd)) % q
+        f1 = ((even - odd) * intt_twiddles[2 * m]) % q
+        f = concatenate((f0, f1), axis=-2)
+        m //= 2
+    return f.reshape(shape)
+
+
 def ntt(f):
     """Compute the NTT of a polynomial.
 
@@ -63,17 +141,7 @@ def ntt(f):
 
     Format: input as coefficients, output as NTT
     """
-    n = len(f)
-    if (n > 2):
-        f0, f1 = split(f)
-        f0_ntt = ntt(f0)
-        f1_ntt = ntt(f1)
-        f_ntt = merge_ntt([f0_ntt, f1_ntt])
-    elif (n == 2):
-        f_ntt = [0] * n
-        f_ntt[0] = (f[0] + sqr1 * f[1]) % q
-        f_ntt[1] = (f[0] - sqr1 * f[1]) % q
-    return f_ntt
+    return ntt_batch(f).tolist()
 
 
 def intt(f_ntt):
@@ -84,17 +152,7 @@ def intt(f_ntt):
 
     Format: input as NTT, output as coefficients
     """
-    n = len(f_ntt)
-    if (n > 2):
-        f0_ntt, f1_ntt = split_ntt(f_ntt)
-        f0 = intt(f0_ntt)
-        f1 = intt(f1_ntt)
-        f = merge([f0, f1])
-    elif (n == 2):
-        f = [0] * n
-        f[0] = (i2 * (f_ntt[0] + f_ntt[1])) % q
-        f[1] = (i2 * inv_mod_q[sqr1] * (f_ntt[0] - f_ntt[1])) % q
-    return f
+    return intt_batch(f_ntt).tolist()
 
 
 def add_zq(f, g):
@@ -117,15 +175,15 @@ def sub_zq(f, g):
 
 def mul_zq(f, g):
     """Multiplication of two polynomials (coefficient representation)."""
-    return intt(mul_ntt(ntt(f), ntt(g)))
+    return intt_batch((ntt_batch(f) * ntt_batch(g)) % q).tolist()
 
 
 def div_zq(f, g):
     """Division of two polynomials (coefficient representation)."""
-    try:
-        return intt(div_ntt(ntt(f), ntt(g)))
-    except ZeroDivisionError:
-        raise
+    g_ntt = ntt_batch(g)
+    if not g_ntt.all():
+        raise ZeroDivisionError
+    return intt_batch((ntt_batch(f) * inv_mod_q_array[g_ntt]) % q).tolist()
 
 
 # def adj(f):
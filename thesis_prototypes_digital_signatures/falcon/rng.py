@@ -16,8 +16,19 @@ Random bits are generated as follow:
 For efficiency reasons, the reference code generates 8 chunks of randomness
 at a time (hence 512 * 8 = 4096 bits), and interleave the outputs by blocks
 of 32 bits. For reproducibility, we do the same here.
+FastChaCha20 outputs the same stream, but computes the block function
+with the (compiled) ChaCha20 cipher of pycryptodome.
+
+It also implements EntropyPool, a buffered source of OS randomness
+used when signing without a seed.
 """
 
+from os import urandom, register_at_fork
+from Crypto.Cipher import ChaCha20 as ChaCha20Cipher
+from numpy import frombuffer
+from threading import Lock
+from weakref import WeakSet
+
 # ChaCha20 constants
 CW = [0x61707865, 0x3320646e, 0x79622d32, 0x6b206574]
 
@@ -119,3 +130,127 @@ class ChaCha20:
         out = "".join(out[i:i + 2] for i in range(2 * k - 2, -1, -2))
         self.hexbytes = self.hexbytes[(2 * k):]
         return bytes.fromhex(out)[::-1]
+
+
+# Position in bytes of the last block of ChaCha20Cipher, that it cannot seek to
+LAST_POSITION = ((1 << 64) - 1) << 6
+
+
+class FastChaCha20(ChaCha20):
+    """
+    Drop-in replacement of ChaCha20 producing the same stream.
+
+    Words 12, 13 of the ChaCha20 matrix (s[8], s[9]) are constant and
+    words 14, 15 depend on ctr: they match the 64-bit block counter and
+    the 64-bit nonce of the original ChaCha20, which is what pycryptodome
+    implements with 8-byte nonces. Each update is thus one block of the
+    cipher, with a fresh nonce, encrypting zeros.
+    """
+
+    def __init__(self, src):
+        """
+        Initialize the PRG. key and position define the cipher,
+        and randombytes serves the bytes of buffer from index pos.
+        """
+        super().__init__(src)
+        self.key = bytes(src[:32])
+        self.position = (self.s[8] + (self.s[9] << 32)) << 6
+        self.buffer = b""
+        self.pos = 0
+
+    def update_bytes(self):
+        """
+        One update of the ChaCha20 PRG, as 64 bytes.
+        """
+        if self.position == LAST_POSITION:
+            return b"".join(elt.to_bytes(4, "little") for elt in self.update())
+        nonce = self.s[10] ^ (self.ctr & 0xffffffff)
+        nonce += (self.s[11] ^ ((self.ctr >> 32) & 0xffffffff)) << 32
+        cipher = ChaCha20Cipher.new(key=self.key, nonce=nonce.to_bytes(8, "little"))
+        cipher.seek(self.position)
+        self.ctr += 1
+        return cipher.encrypt(bytes(64))
+
+    def block_update(self):
+        """
+        Produces 8 consecutive updates, and interleave the results.
+        """
+        blocks = b"".join(self.update_bytes() for i in range(8))
+        # Word j of block i is the (8 * j + i)-th word of the output
+        return frombuffer(blocks, dtype="<u4").reshape(8, 16).T.tobytes()
+
+    def randombytes(self, k):
+        """
+        Generate random bytes. As in ChaCha20, the unused bytes
+        of a block are dropped if there are fewer than k of them.
+        """
+        if (self.pos + k > len(self.buffer)):
+            self.buffer = self.block_update()
+            self.pos = 0
+        out = self.buffer[self.pos:self.pos + k]
+        self.pos += k
+        return out
+
+
+# Default number of bytes read from the OS at once by an EntropyPool
+POOL_SIZE = 1 << 16
+
+# All the entropy pools, which are emptied in the child after a fork
+pools = WeakSet()
+
+
+class EntropyPool:
+    """
+    Source of randomness that reads urandom in blocks of buffer_size
+    bytes, and serves randombytes calls from this buffer.
+    A buffer_size of 0 reads urandom on each call, as urandom itself.
+
+    syscalls and nbytes count the reads of urandom and the bytes served.
+    The pool can be shared by several threads, and is emptied in the
+    child process after a fork so that the buffer is never served twice.
+    """
+
+    def __init__(self, buffer_size=POOL_SIZE):
+        """Initialize an empty pool."""
+        self.buffer_size = buffer_size
+        self.lock = Lock()
+        self.buffer = b""
+        self.pos = 0
+        self.syscalls = 0
+        self.nbytes = 0
+        pools.add(self)
+
+    def __repr__(self):
+        """Print the pool statistics."""
+        rep = "buffer_size = {size}\n".format(size=self.buffer_size)
+        rep += "syscalls = {syscalls}\n".format(syscalls=self.syscalls)
+        rep += "nbytes = {nbytes}".format(nbytes=self.nbytes)
+        return rep
+
+    def clear(self):
+        """Drop the buffered bytes."""
+        self.buffer = b""
+        self.pos = 0
+
+    def randombytes(self, k):
+        """Return k random bytes."""
+        with self.lock:
+            if self.pos + k > len(self.buffer):
+                # Keep the bytes not served yet and refill the buffer
+                rest = self.buffer[self.pos:]
+                self.buffer = rest + urandom(max(self.buffer_size, k - len(rest)))
+                self.pos = 0
+                self.syscalls += 1
+            out = self.buffer[self.pos:self.pos + k]
+            self.pos += k
+            self.nbytes += k
+            return out
+
+
+def clear_pools():
+    """Empty all the entropy pools."""
+    for pool in list(pools):
+        pool.clear()
+
+
+register_at_fork(after_in_child=clear_pools)
@@ -1,5 +1,7 @@
 # Importing dependencies
 from math import floor
+from numpy import array, asarray, broadcast_arrays, empty, exp, arange
+from numpy import floor as floor_batch, float64, int64, uint64, dtype, frombuffer
 
 # Use high-quality randomness
 # The "secrets" library could also work (Python >= 3.6)
@@ -41,6 +43,11 @@ RCDT = [
     1]
 
 
+# RCDT split in its 8 high bits and its 64 low bits, for samplerz_batch
+RCDT_HI = array([elt >> 64 for elt in RCDT], dtype=uint64)
+RCDT_LO = array([elt & ((1 << 64) - 1) for elt in RCDT], dtype=uint64)
+
+
 # C contains the coefficients of a polynomial that approximates exp(-x)
 # More precisely, the value:
 # (2 ** -63) * sum(C[12 - i] * (x ** i) for i in range(i))
@@ -151,3 +158,52 @@ def samplerz(mu, sigma, sigmin, randombytes=urandom):
         x -= (z0 ** 2) * INV_2SIGMA2
         if berexp(x, ccs, randombytes=randombytes):
             return z + s
+
+
+# Random bytes consumed per lane and per round of samplerz_batch:
+# 72 bits for the base sampler, 1 byte for the sign and 8 bytes for the
+# rejection step.
+BATCH_RANDOM = dtype([("lo", "<u8"), ("hi", "u1"), ("b", "u1"), ("w", "<u8")])
+
+
+def samplerz_batch(mu, sigma, sigmin, randombytes=urandom):
+    """
+    Given arrays of floating-point values mu, sigma (and sigmin), output
+    an array of integers z, where z[i] follows the discrete Gaussian
+    distribution D_{Z, mu[i], sigma[i]}. The inputs are broadcast
+    against each other, and so is the output.
+
+    This follows samplerz on all lanes at once: the base sampler compares
+    all the 72-bit draws against RCDT, then the rejected lanes are sampled
+    again until none remains. The rejection step compares a uniform
+    float against ccs * exp(-x) instead of running berexp, hence the
+    output does not match samplerz for a given randomness source.
+    The inputs MUST verify 1 < sigmin < sigma < MAX_SIGMA.
+    """
+    mu, sigma, sigmin = broadcast_arrays(
+        asarray(mu, dtype=float64), asarray(sigma, dtype=float64), asarray(sigmin, dtype=float64))
+    shape = mu.shape
+    mu, sigma, sigmin = mu.ravel(), sigma.ravel(), sigmin.ravel()
+    s = floor_batch(mu)
+    r = mu - s
+    dss = 1 / (2 * sigma * sigma)
+    ccs = sigmin / sigma
+
+    z = empty(mu.size, dtype=int64)
+    # Indices of the lanes that still need a sample
+    todo = arange(mu.size)
+    while todo.size:
+        rand = frombuffer(randombytes(BATCH_RANDOM.itemsize * todo.size), dtype=BATCH_RANDOM)
+        # Sample z0 from a Half-Gaussian
+        hi, lo = rand["hi"][:, None], rand["lo"][:, None]
+        z0 = ((hi < RCDT_HI) | ((hi == RCDT_HI) & (lo < RCDT_LO))).sum(axis=1)
+        # Convert z0 into a pseudo-Gaussian sample
+        b = (rand["b"] & 1).astype(int64)
+        zb = b + (2 * b - 1) * z0
+        # Rejection sampling to obtain a true Gaussian sample
+        x = ((zb - r[todo]) ** 2) * dss[todo]
+        x -= (z0 ** 2) * INV_2SIGMA2
+        accept = (rand["w"] >> 11) * (2 ** -53) < ccs[todo] * exp(-x)
+        z[todo[accept]] = zb[accept] + s[todo[accept]]
+        todo = todo[~accept]
+    return z.reshape(shape)
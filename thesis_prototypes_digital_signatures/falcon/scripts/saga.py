@@ -173,8 +173,9 @@ class UnivariateSamples:
         obs.pop(-1)
         exp.pop(-1)
         exp = [round(prob * self.nsamples) for prob in exp]
-        diff = self.nsamples - sum(exp_histogram.values())
-        exp_histogram[int(round(self.exp_mu))] += diff
+        # Absorb the rounding errors in the largest bucket, since
+        # chisquare requires the observed and expected sums to match
+        exp[exp.index(max(exp))] += sum(obs) - sum(exp)
         res = chisquare(obs, f_exp=exp)
         return res
 
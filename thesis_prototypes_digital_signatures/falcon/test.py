@@ -5,23 +5,40 @@ Test the code with:
 > make test
 """
 from falcon.common import q, sqnorm
-from falcon.fft import add, sub, mul, div, neg, fft, ifft
-from falcon.ntt import mul_zq, div_zq
-from falcon.samplerz import samplerz, MAX_SIGMA
+from falcon.fft import add, sub, mul, div, neg, adj, fft, ifft, fft_batch, ifft_batch
+from falcon.ntt import mul_zq, div_zq, ntt, ntt_batch, intt_batch
+from falcon.samplerz import samplerz, samplerz_batch, MAX_SIGMA
 from falcon.ffsampling import ffldl, ffldl_fft, ffnp, ffnp_fft
-from falcon.ffsampling import gram
+from falcon.ffsampling import gram, ffsampling_fft, ffldl_flat, ffsampling_flat, flat_tree_lists
+from falcon.falcon import normalize_tree
 from random import randint, random, gauss, uniform
 from math import sqrt, ceil
-from falcon.ntrugen import karamul, ntru_gen, gs_norm
-from falcon.falcon import SecretKey, PublicKey, Params
-from falcon.falcon import SALT_LEN, HEAD_LEN, SHAKE256
-from falcon.encoding import compress, decompress
+from falcon.ntrugen import karamul, karatsuba, kronecker_mul, ntru_gen, gs_norm
+from falcon.ntrugen import gen_poly, SIGMA_FG, NtruGenStats
+from falcon.keygen import KeygenPool
+from falcon.falcon import SecretKey, PublicKey, Params, verify_batch_multikey
+from falcon.falcon import SALT_LEN, HEAD_LEN, SHAKE256, XOFS
+from falcon.falcon import param_context, recover, recover_batch, verify_recoverable
+from falcon.falcon import verify_and_recover
+from falcon.encoding import compress, decompress, compress_compact, decompress_compact
+from falcon.rng import EntropyPool, ChaCha20, FastChaCha20
+from falcon.keystore import save_keys, load_keys
+from tempfile import TemporaryDirectory
+from os import path, stat, listdir
+from threading import Thread
 from falcon.scripts import saga
 from falcon.scripts.samplerz_KAT512 import sampler_KAT512
 from falcon.scripts.sign_KAT import sign_KAT
 from falcon.scripts.samplerz_KAT1024 import sampler_KAT1024
 # https://stackoverflow.com/a/25823885/4143624
 from timeit import default_timer as timer
+from numpy import rint, array, sqrt as sqrt_batch
+from scipy.stats import chi2_contingency
+from statistics import variance
+from collections import Counter
+from falcon.fft_constants import roots_dict
+from falcon.ntt_constants import roots_dict_Zq, inv_mod_q
+from falcon.common import merge
 
 
 def vecmatmul(t, B):
@@ -59,6 +76,81 @@ def test_fft(n, iterations=10):
     return True
 
 
+def fft_ref(f):
+    """
+    Reference FFT: the recursive, scalar FFT that fft_batch replaced.
+    It returns all the n FFT coefficients, whose first half is the short
+    FFT computed by fft_batch.
+    """
+    n = len(f)
+    if (n == 2):
+        return [f[0] + 1j * f[1], f[0] - 1j * f[1]]
+    f0_fft = fft_ref(f[0::2])
+    f1_fft = fft_ref(f[1::2])
+    w = roots_dict[n]
+    f_fft = [0] * n
+    for i in range(n // 2):
+        f_fft[2 * i + 0] = f0_fft[i] + w[2 * i] * f1_fft[i]
+        f_fft[2 * i + 1] = f0_fft[i] - w[2 * i] * f1_fft[i]
+    return f_fft
+
+
+def ifft_ref(f_fft):
+    """Reference inverse FFT, taking all the n FFT coefficients (see fft_ref)."""
+    n = len(f_fft)
+    if (n == 2):
+        return [f_fft[0].real, f_fft[0].imag]
+    w = roots_dict[n]
+    f0_fft = [0.5 * (f_fft[2 * i] + f_fft[2 * i + 1]) for i in range(n // 2)]
+    f1_fft = [0.5 * (f_fft[2 * i] - f_fft[2 * i + 1]) * w[2 * i].conjugate() for i in range(n // 2)]
+    return merge([ifft_ref(f0_fft), ifft_ref(f1_fft)])
+
+
+def ntt_ref(f):
+    """Reference NTT: the recursive, scalar NTT that ntt_batch replaced."""
+    n = len(f)
+    if (n == 2):
+        sqr1 = roots_dict_Zq[2][0]
+        return [(f[0] + sqr1 * f[1]) % q, (f[0] - sqr1 * f[1]) % q]
+    f0_ntt = ntt_ref(f[0::2])
+    f1_ntt = ntt_ref(f[1::2])
+    w = roots_dict_Zq[n]
+    f_ntt = [0] * n
+    for i in range(n // 2):
+        f_ntt[2 * i + 0] = (f0_ntt[i] + w[2 * i] * f1_ntt[i]) % q
+        f_ntt[2 * i + 1] = (f0_ntt[i] - w[2 * i] * f1_ntt[i]) % q
+    return f_ntt
+
+
+def intt_ref(f_ntt):
+    """Reference inverse NTT: the recursive, scalar inverse NTT that intt_batch replaced."""
+    n = len(f_ntt)
+    i2 = inv_mod_q[2]
+    if (n == 2):
+        sqr1 = roots_dict_Zq[2][0]
+        return [(i2 * (f_ntt[0] + f_ntt[1])) % q, (i2 * inv_mod_q[sqr1] * (f_ntt[0] - f_ntt[1])) % q]
+    w = roots_dict_Zq[n]
+    f0_ntt = [(i2 * (f_ntt[2 * i] + f_ntt[2 * i + 1])) % q for i in range(n // 2)]
+    f1_ntt = [(i2 * (f_ntt[2 * i] - f_ntt[2 * i + 1]) * inv_mod_q[w[2 * i]]) % q for i in range(n // 2)]
+    return merge([intt_ref(f0_ntt), intt_ref(f1_ntt)])
+
+
+def test_fft_batch(n, iterations=10):
+    """
+    Test that the batched FFT agrees with the reference recursive FFT,
+    and that the inverse batched FFT inverts the batched FFT.
+    """
+    batch = [[randint(-3, 4) for j in range(n)] for i in range(iterations)]
+    batch_fft = fft_batch(batch)
+    for (f, f_fft) in zip(batch, batch_fft):
+        if abs(f_fft - array(fft_ref(f)[:n // 2])).max() > 1e-6:
+            return False
+        if [int(round(coef)) for coef in ifft_ref(fft_ref(f))] != f:
+            return False
+    back = ifft_batch(batch_fft).tolist()
+    return [[int(round(coef)) for coef in f] for f in back] == batch
+
+
 def test_ntt(n, iterations=10):
     """Test the NTT."""
     for i in range(iterations):
@@ -77,6 +169,26 @@ def test_ntt(n, iterations=10):
     return True
 
 
+def test_ntt_batch(n, iterations=10):
+    """
+    Test that the batched NTT agrees with the reference recursive NTT,
+    that products computed with it agree with a reference negacyclic
+    product (Karatsuba over the integers), and that the inverse batched
+    NTT inverts the batched NTT.
+    """
+    batch_f = [[randint(0, q - 1) for j in range(n)] for i in range(iterations)]
+    batch_g = [[randint(0, q - 1) for j in range(n)] for i in range(iterations)]
+    batch_f_ntt = ntt_batch(batch_f)
+    if (batch_f_ntt[0].tolist() != ntt_ref(batch_f[0])) or (intt_ref(ntt_ref(batch_f[0])) != batch_f[0]):
+        return False
+    batch_fg = intt_batch((batch_f_ntt * ntt_batch(batch_g)) % q).tolist()
+    for (f, g, fg) in zip(batch_f, batch_g, batch_fg):
+        ref = karatsuba(f, g, n)
+        if fg != [(ref[j] - ref[j + n]) % q for j in range(n)]:
+            return False
+    return intt_batch(batch_f_ntt).tolist() == batch_f
+
+
 def check_ntru(f, g, F, G):
     """Check that f * G - g * F = q mod (x ** n + 1)."""
     a = karamul(f, G)
@@ -85,13 +197,107 @@ def check_ntru(f, g, F, G):
     return ((c[0] == q) and all(coef == 0 for coef in c[1:]))
 
 
+def test_kronecker(n, iterations=10):
+    """Test that kronecker_mul agrees with Karatsuba, on coefficients of various sizes."""
+    for i in range(iterations):
+        size = randint(1, 4000)
+        f = [randint(-(1 << size), (1 << size)) for j in range(n)]
+        g = [randint(-(1 << 12), (1 << 12)) for j in range(n)]
+        fg = karatsuba(f, g, n)
+        if kronecker_mul(f, g) != [fg[j] - fg[j + n] for j in range(n)]:
+            return False
+    return True
+
+
+def test_gen_poly(n, iterations=10):
+    """
+    Test the table-driven sampler of gen_poly and the samplerz-based
+    reference (sums of samples of samplerz_batch), with SAGA. Also test
+    that both samplers follow the same distribution: their histograms
+    must pass a chi-square test of homogeneity, and their variances must
+    agree within 5 standard errors.
+    """
+    k = 4096 // n
+    sigma = SIGMA_FG * sqrt(k)
+    nb_rej = 0
+    for i in range(iterations):
+        samples = []
+        while len(samples) < 10000:
+            samples += gen_poly(n)
+        reference = samplerz_batch([0] * (k * len(samples)), SIGMA_FG, SIGMA_FG - 0.001)
+        reference = reference.reshape(len(samples), k).sum(axis=1).tolist()
+        for list_samples in [samples, reference]:
+            v = saga.UnivariateSamples(0, sigma, list_samples)
+            if (v.is_valid is False):
+                nb_rej += 1
+        if (homogeneity_pvalue(samples, reference) < saga.pmin):
+            nb_rej += 1
+        # The relative standard error of the ratio of the variances is 2 / sqrt(len(samples))
+        if abs(variance(samples) / variance(reference) - 1) > 10 / sqrt(len(samples)):
+            return False
+    return (nb_rej <= 5 * ceil(saga.pmin * 3 * iterations))
+
+
+def homogeneity_pvalue(samples, reference):
+    """
+    Return the p-value of a chi-square test of homogeneity between two lists
+    of integer samples. Consecutive values are merged into bins until each
+    bin holds at least 20 samples of each list.
+    """
+    counts = [Counter(samples), Counter(reference)]
+    table = [[], []]
+    acc = [0, 0]
+    for value in sorted(set(counts[0]) | set(counts[1])):
+        acc = [acc[0] + counts[0][value], acc[1] + counts[1][value]]
+        if min(acc) >= 20:
+            table[0] += [acc[0]]
+            table[1] += [acc[1]]
+            acc = [0, 0]
+    table[0][-1] += acc[0]
+    table[1][-1] += acc[1]
+    return chi2_contingency(table)[1]
+
+
+def gs_norm_ref(f, g, q):
+    """
+    Reference implementation of gs_norm, in coefficient representation.
+    """
+    sqnorm_fg = sqnorm([f, g])
+    ffgg = add(mul(f, adj(f)), mul(g, adj(g)))
+    Ft = div(adj(g), ffgg)
+    Gt = div(adj(f), ffgg)
+    sqnorm_FG = (q ** 2) * sqnorm([Ft, Gt])
+    return max(sqnorm_fg, sqnorm_FG)
+
+
+def test_gs_norm(n, iterations=10):
+    """Test that gs_norm (in FFT representation) agrees with the reference."""
+    for i in range(iterations):
+        f = gen_poly(n)
+        g = gen_poly(n)
+        if abs(gs_norm(f, g, q) - gs_norm_ref(f, g, q)) > 1e-9 * gs_norm_ref(f, g, q):
+            return False
+    return True
+
+
 def test_ntrugen(n, iterations=10):
-    """Test ntru_gen."""
+    """Test ntru_gen, and that its counters account for all the candidates."""
+    stats = NtruGenStats()
     for i in range(iterations):
-        f, g, F, G = ntru_gen(n)
+        f, g, F, G = ntru_gen(n, stats=stats)
         if check_ntru(f, g, F, G) is False:
             return False
-    return True
+    return (stats.keys == iterations) and (stats.candidates == iterations + sum(stats.rejections.values()))
+
+
+def test_keygen_pool(n, iterations=1):
+    """Test the speculative and bulk key generation of a KeygenPool."""
+    with KeygenPool(2) as pool:
+        for i in range(iterations):
+            if check_ntru(*pool.ntru_gen(n)) is False:
+                return False
+        keys = pool.ntru_gen_bulk(n, 2)
+    return (len(keys) == 2) and all(check_ntru(*polys) for polys in keys)
 
 
 def test_ffnp(n, iterations):
@@ -137,6 +343,37 @@ def test_ffnp(n, iterations):
         return True
 
 
+def test_ffsampling_flat(n, iterations):
+    """
+    Test that ffldl_flat and ffsampling_flat are consistent
+    with ffldl_fft and ffsampling_fft for the same randomness,
+    with or without the list forms of the flattened tree.
+    """
+    f = sign_KAT[n][0]["f"]
+    g = sign_KAT[n][0]["g"]
+    F = sign_KAT[n][0]["F"]
+    G = sign_KAT[n][0]["G"]
+    B0_fft = fft_batch([[g, neg(f)], [G, neg(F)]])
+    G0_fft = (B0_fft[:, None] * B0_fft[None, :].conjugate()).sum(axis=2)
+    sigma, sigmin = Params[n]["sigma"], Params[n]["sigmin"]
+    T_fft = ffldl_fft(G0_fft.tolist())
+    normalize_tree(T_fft, sigma)
+    T_flat = ffldl_flat(G0_fft)
+    T_flat[1] = sigma / sqrt_batch(T_flat[1])
+    for i in range(iterations):
+        t_fft = fft_batch([[uniform(-q, q) for j in range(n)] for k in range(2)]).tolist()
+        seed = bytes(randint(0, 255) for j in range(56))
+        z = ffsampling_fft(t_fft, T_fft, sigmin, FastChaCha20(seed).randombytes)
+        z_flat = ffsampling_flat(t_fft, T_flat, sigmin, FastChaCha20(seed).randombytes)
+        if (rint(ifft_batch(z)) != rint(ifft_batch(z_flat))).any():
+            return False
+        # With the list forms of the tree, and scratch buffers reused from the previous call
+        z_lists = ffsampling_flat(t_fft, flat_tree_lists(T_flat), sigmin, FastChaCha20(seed).randombytes)
+        if (rint(ifft_batch(z_lists)) != rint(ifft_batch(z_flat))).any():
+            return False
+    return True
+
+
 def test_compress(n, iterations):
     """Test compression and decompression."""
     try:
@@ -156,6 +393,32 @@ def test_compress(n, iterations):
     return True
 
 
+def test_decompress_invalid(n, iterations):
+    """Test that decompression rejects invalid encodings."""
+    try:
+        slen = Params[n]["sig_bytelen"] - SALT_LEN - HEAD_LEN
+    except KeyError:
+        return True
+    # Zero has a unique encoding: flip the sign bit of a zero coefficient
+    compressed = bytearray(compress([0] * n, slen))
+    compressed[0] |= 0x80
+    if decompress(bytes(compressed), slen, n) is not False:
+        return False
+    # Encodings of zero coefficients only
+    if decompress(bytes(slen), slen, n) is not False:
+        return False
+    for i in range(iterations):
+        initial = [randint(-300, 300) for coef in range(n)]
+        compressed = compress(initial, slen)
+        if compressed is False:
+            continue
+        # Truncated encodings
+        length = len(compressed.rstrip(b"\x00"))
+        if decompress(compressed[:length - 1], slen, n) is not False:
+            return False
+    return True
+
+
 def test_samplerz(nb_mu=100, nb_sig=100, nb_samp=1000):
     """
     Test our Gaussian sampler on a bunch of samples.
@@ -182,6 +445,28 @@ def test_samplerz(nb_mu=100, nb_sig=100, nb_samp=1000):
         return True
 
 
+def test_samplerz_batch(nb_mu=100, nb_sig=100, nb_samp=1000):
+    """
+    Test our batch Gaussian sampler on a bunch of samples,
+    as test_samplerz does for samplerz.
+    """
+    sigmin = 1.3
+    nb_rej = 0
+    for i in range(nb_mu):
+        mu = uniform(0, q)
+        sigma = [uniform(sigmin, MAX_SIGMA) for j in range(nb_sig)]
+        # Each row of samples shares the same mu and sigma
+        samples = samplerz_batch([[mu] * nb_samp], [[elt] for elt in sigma], sigmin)
+        for j in range(nb_sig):
+            v = saga.UnivariateSamples(mu, sigma[j], samples[j].tolist())
+            if (v.is_valid is False):
+                nb_rej += 1
+    if (nb_rej > 5 * ceil(saga.pmin * nb_mu * nb_sig)):
+        return False
+    else:
+        return True
+
+
 def KAT_randbytes(k):
     """
     Use a fixed bytestring 'octets' as a source of random bytes
@@ -216,6 +501,39 @@ def test_samplerz_KAT(unused, unused2):
     return True
 
 
+def hash_to_point_ref(n, message, salt, new_xof):
+    """
+    Reference hash_to_point, reading the XOF two bytes at a time.
+    """
+    k = (1 << 16) // q
+    shake = new_xof()
+    shake.update(salt)
+    shake.update(message)
+    hashed = [0 for i in range(n)]
+    i = 0
+    while i < n:
+        twobytes = shake.read(2)
+        elt = (twobytes[0] << 8) + twobytes[1]
+        if elt < k * q:
+            hashed[i] = elt % q
+            i += 1
+    return hashed
+
+
+def test_hash_to_point(n, iterations=10):
+    """Test that hash_to_point matches the reference implementation, for each XOF."""
+    if n not in Params:
+        return True
+    for xof in XOFS:
+        pk = PublicKey(n, [0] * n, xof)
+        for i in range(iterations):
+            message = i.to_bytes(4, "little")
+            salt = bytes(randint(0, 255) for j in range(SALT_LEN))
+            if pk.hash_to_point(message, salt) != hash_to_point_ref(n, message, salt, XOFS[xof]):
+                return False
+    return True
+
+
 def test_signature(n, iterations=10):
     """
     Test Falcon.
@@ -225,7 +543,7 @@ def test_signature(n, iterations=10):
     F = sign_KAT[n][0]["F"]
     G = sign_KAT[n][0]["G"]
     sk = SecretKey(n, [f, g, F, G])
-    pk = PublicKey(sk)
+    pk = PublicKey(n, sk.encode_public_key())
     for i in range(iterations):
         message = b"abc"
         sig = sk.sign(message)
@@ -234,6 +552,266 @@ def test_signature(n, iterations=10):
     return True
 
 
+def test_sign_recoverable(n, iterations=10):
+    """
+    Test signing in public key recovery mode, and that
+    the public key is recovered from the signatures.
+    """
+    D = sign_KAT[n][0]
+    sk = SecretKey(n, [D["f"], D["g"], D["F"], D["G"]])
+    for i in range(iterations):
+        message = i.to_bytes(4, "little")
+        sig = sk.sign_recoverable(message)
+        if (sk.verify_recoverable(message, sig) is False) or (sk.recover(message, sig) != sk.h):
+            return False
+    return True
+
+
+def test_recover_batch(n, iterations=10):
+    """
+    Test that batch recovery agrees with recover, including
+    on signatures of the wrong message and on invalid encodings.
+    """
+    D = sign_KAT[n][0]
+    sk = SecretKey(n, [D["f"], D["g"], D["F"], D["G"]])
+    messages = [i.to_bytes(4, "little") for i in range(iterations)]
+    signatures = [sk.sign_recoverable(message) for message in messages]
+    # Wrong message and truncated signature
+    messages += [b"wrong message", messages[0]]
+    signatures += [signatures[0], signatures[0][:HEAD_LEN + SALT_LEN + 1]]
+    recovered = sk.recover_batch(messages, signatures)
+    if (recovered[-1] is not False) or (recovered[0] != sk.h):
+        return False
+    return recovered[:-1] == [sk.recover(messages[i], signatures[i]) for i in range(iterations + 1)]
+
+
+def test_stateless_recovery(n, iterations=10):
+    """
+    Test that the module-level recover, recover_batch and verify_recoverable
+    agree with the methods of the keys, for several XOFs, and that they
+    reject signatures whose s2 is not invertible.
+    Each XOF signs with its own KAT key.
+    """
+    for (j, xof) in enumerate(XOFS):
+        D = sign_KAT[n][j]
+        sk = SecretKey(n, [D["f"], D["g"], D["F"], D["G"]], xof)
+        messages = [i.to_bytes(4, "little") for i in range(iterations)]
+        signatures = [sk.sign_recoverable(message) for message in messages]
+        for (message, signature) in zip(messages, signatures):
+            if (recover(n, message, signature, xof) != sk.h):
+                return False
+            if (verify_recoverable(n, message, signature, xof) is False):
+                return False
+        if recover_batch(n, messages, signatures, xof) != [sk.h] * iterations:
+            return False
+        if param_context(n, xof) is not sk.context:
+            return False
+    # A signature with s2 = 0 is rejected
+    s1 = sk.split_and_decompress_signature(signatures[0])[1]
+    slen = sk.context.slen
+    sig = signatures[0][:HEAD_LEN + SALT_LEN] + compress(s1, slen) + compress([0] * n, slen)
+    if (sk.recover(messages[0], sig) is not False) or (recover(n, messages[0], sig, xof) is not False):
+        return False
+    # Truncated and extended signatures are rejected
+    for sig in [signatures[0][:HEAD_LEN + SALT_LEN + 1], signatures[0][:-1], signatures[0] + bytes(1)]:
+        if (recover(n, messages[0], sig, xof) is not False) or (verify_recoverable(n, messages[0], sig, xof) is not False):
+            return False
+    return True
+
+
+def test_verify_and_recover(n, iterations=10):
+    """
+    Test that verify_and_recover accepts signatures under the fingerprint of
+    their key, and rejects other fingerprints, messages and invalid encodings.
+    """
+    keys = [SecretKey(n, [D["f"], D["g"], D["F"], D["G"]]) for D in sign_KAT[n][:2]]
+    sk = keys[0]
+    fingerprint = sk.key_fingerprint()
+    other = keys[1].key_fingerprint()
+    for i in range(iterations):
+        message = i.to_bytes(4, "little")
+        sig = sk.sign_recoverable(message)
+        if verify_and_recover(n, message, sig, fingerprint) is False:
+            return False
+        if verify_and_recover(n, message, sig, other) is True:
+            return False
+        if verify_and_recover(n, b"wrong message", sig, fingerprint) is True:
+            return False
+    return verify_and_recover(n, message, sig[:HEAD_LEN + SALT_LEN + 1], fingerprint) is False
+
+
+def test_compact_recoverable(n, iterations=10):
+    """
+    Test compact signatures in public key recovery mode: the key is
+    recovered, the pair (s1, s2) is the same as in the default layout,
+    and non-canonical encodings are rejected.
+    """
+    D = sign_KAT[n][0]
+    sk = SecretKey(n, [D["f"], D["g"], D["F"], D["G"]])
+    slen = 2 * (Params[n]["sig_bytelen"] - SALT_LEN - HEAD_LEN)
+    for i in range(iterations):
+        message = i.to_bytes(4, "little")
+        sig = sk.sign_recoverable(message, compact=True)
+        if (recover(n, message, sig) != sk.h) or (sk.verify_recoverable(message, sig) is False):
+            return False
+        salt, s1, s2 = sk.split_and_decompress_signature(sig)
+        if compress_compact(s1 + s2, slen) != sig[HEAD_LEN + SALT_LEN:]:
+            return False
+        # Trailing bytes and truncations are rejected
+        if (recover(n, message, sig + bytes(1)) is not False) or (recover(n, message, sig[:-1]) is not False):
+            return False
+        # Non-zero padding bits are rejected
+        nb_bits = sum(9 + (abs(coef) >> 7) for coef in s1 + s2)
+        enc_s = sig[HEAD_LEN + SALT_LEN:]
+        if (nb_bits % 8) and (decompress_compact(enc_s[:-1] + bytes([enc_s[-1] | 1]), slen, 2 * n) is not False):
+            return False
+    return True
+
+
+def test_chacha20(n, iterations=10):
+    """Test that FastChaCha20 outputs the same stream as ChaCha20."""
+    for i in range(iterations):
+        seed = bytes(randint(0, 255) for j in range(56))
+        prg, fast_prg = ChaCha20(seed), FastChaCha20(seed)
+        for j in range(100):
+            k = randint(1, 64)
+            if prg.randombytes(k) != fast_prg.randombytes(k):
+                return False
+    return True
+
+
+def test_entropy_pool(n, iterations=10):
+    """
+    Test signing with a buffered entropy pool,
+    and that the pool reads urandom in blocks.
+    """
+    D = sign_KAT[n][0]
+    sk = SecretKey(n, [D["f"], D["g"], D["F"], D["G"]])
+    pool = EntropyPool(1024)
+    for i in range(iterations):
+        message = b"abc"
+        sig = sk.sign(message, pool=pool)
+        if sk.verify(message, sig) is False:
+            return False
+    # Signing never asks for more than 1024 bytes at once, so the pool
+    # reads urandom exactly once per 1024 bytes served
+    return pool.syscalls == -(-pool.nbytes // 1024)
+
+
+def test_keystore(n, iterations=10):
+    """
+    Test that keys loaded from a key file sign as the original keys,
+    that the key file is only readable by its owner, and that an empty
+    list of keys or a corrupted key file is rejected.
+    """
+    keys = [SecretKey(n, [D["f"], D["g"], D["F"], D["G"]]) for D in sign_KAT[n][:2]]
+    with TemporaryDirectory() as directory:
+        filename = path.join(directory, "keys")
+        try:
+            save_keys(filename, [])
+            return False
+        except ValueError:
+            pass
+        save_keys(filename, keys)
+        if (stat(filename).st_mode & 0o777 != 0o600) or (listdir(directory) != ["keys"]):
+            return False
+        loaded = load_keys(filename)
+        for i in range(iterations):
+            message = i.to_bytes(4, "little")
+            for (sk, sk_loaded) in zip(keys, loaded):
+                shake, shake_loaded = SHAKE256.new(message), SHAKE256.new(message)
+                if sk.sign(message, shake.read) != sk_loaded.sign(message, shake_loaded.read):
+                    return False
+        del loaded
+        with open(filename, "r+b") as file:
+            file.seek(-1, 2)
+            last = file.read(1)
+            file.seek(-1, 2)
+            file.write(bytes([last[0] ^ 1]))
+        try:
+            load_keys(filename)
+            return False
+        except ValueError:
+            return True
+
+
+def test_lazy_expansion(n, iterations=10):
+    """
+    Test that a key is only expanded by signing, that concurrent
+    expansions compute a single expansion, and that a shrunk key
+    signs as before.
+    """
+    D = sign_KAT[n][0]
+    sk = SecretKey(n, [D["f"], D["g"], D["F"], D["G"]])
+    sig = sk.sign(b"abc")
+    if (sk.expansion is None) or (sk.verify(b"abc", sig) is False):
+        return False
+    sk.shrink()
+    sk.sign(b"abc", SHAKE256.new(b"abc").read)
+    if (sk.expansion is None):
+        return False
+
+    sk = SecretKey(n, [D["f"], D["g"], D["F"], D["G"]])
+    if (sk.verify(b"abc", sig) is False) or (sk.expansion is not None):
+        return False
+    expansions = []
+    threads = [Thread(target=lambda: expansions.append(sk.expand())) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if any(elt is not expansions[0] for elt in expansions):
+        return False
+
+    for i in range(iterations):
+        message = i.to_bytes(4, "little")
+        before = sk.sign(message, SHAKE256.new(message).read)
+        sk.shrink()
+        if sk.sign(message, SHAKE256.new(message).read) != before:
+            return False
+    return True
+
+
+def test_verify_batch(n, iterations=10):
+    """
+    Test that batch verification agrees with verify, including
+    on signatures of the wrong message, on invalid encodings and
+    on an empty batch.
+    """
+    f = sign_KAT[n][0]["f"]
+    g = sign_KAT[n][0]["g"]
+    F = sign_KAT[n][0]["F"]
+    G = sign_KAT[n][0]["G"]
+    sk = SecretKey(n, [f, g, F, G])
+    pk = PublicKey(n, sk.h)
+    messages = [i.to_bytes(4, "little") for i in range(iterations)]
+    signatures = [sk.sign(message) for message in messages]
+    messages[0] = b"wrong message"
+    signatures[-1] = signatures[-1][:-1] + b"\xff"
+    expected = [pk.verify(messages[i], signatures[i]) for i in range(iterations)]
+    if len(pk.verify_batch([], [])) != 0:
+        return False
+    return list(pk.verify_batch(messages, signatures)) == expected
+
+
+def test_verify_batch_multikey(n, iterations=10):
+    """
+    Test that multi-key batch verification agrees with verify,
+    with tiles that do not divide the number of signatures.
+    """
+    sks = [SecretKey(n, [D["f"], D["g"], D["F"], D["G"]]) for D in sign_KAT[n][:3]]
+    pks = [PublicKey(n, sk.h) for sk in sks]
+    keys = [pks[i % 3] for i in range(iterations)]
+    messages = [i.to_bytes(4, "little") for i in range(iterations)]
+    signatures = [sks[i % 3].sign(messages[i]) for i in range(iterations)]
+    # Signatures under another key must be rejected
+    keys[0] = pks[1]
+    signatures[-1] = signatures[-1][:-1] + b"\xff"
+    expected = [keys[i].verify(messages[i], signatures[i]) for i in range(iterations)]
+    result = verify_batch_multikey(keys, messages, signatures, tile_size=4)
+    return list(result) == expected
+
+
 def test_sign_KAT():
     """
     Test the signing procedure against test vectors obtained from
@@ -285,18 +863,44 @@ def test_samplerz_simple(n, iterations):
     return test_samplerz(10, 10, iterations // 100)
 
 
+def test_samplerz_batch_simple(n, iterations):
+    return test_samplerz_batch(10, 10, iterations // 100)
+
+
 def test(n, iterations=500):
     """A battery of tests."""
     wrapper_test(test_fft, "FFT", n, iterations)
+    wrapper_test(test_fft_batch, "FFT batch", n, iterations)
     wrapper_test(test_ntt, "NTT", n, iterations)
+    wrapper_test(test_ntt_batch, "NTT batch", n, iterations)
+    wrapper_test(test_kronecker, "Kronecker", n, 10)
+    wrapper_test(test_gen_poly, "Gen poly", n, 10)
+    wrapper_test(test_gs_norm, "GS norm", n, iterations)
     # test_ntrugen is super slow, hence performed over a single iteration
     wrapper_test(test_ntrugen, "NTRUGen", n, 1)
+    # The pool does not depend on n, and key generation is slow for large n
+    if (n <= 256):
+        wrapper_test(test_keygen_pool, "Keygen pool", n, 1)
     wrapper_test(test_ffnp, "ffNP", n, iterations)
     # test_compress and test_signature are only performed
     # for parameter sets that are defined.
     if (n in Params):
+        wrapper_test(test_ffsampling_flat, "ffSampling flat", n, iterations)
         wrapper_test(test_compress, "Compress", n, iterations)
+        wrapper_test(test_decompress_invalid, "Decompress invalid", n, iterations)
+        wrapper_test(test_hash_to_point, "HashToPoint", n, iterations)
         wrapper_test(test_signature, "Signature", n, iterations)
+        wrapper_test(test_sign_recoverable, "Sign recoverable", n, iterations)
+        wrapper_test(test_recover_batch, "Recover batch", n, iterations)
+        # test_stateless_recovery signs with each XOF, hence over a few iterations
+        wrapper_test(test_stateless_recovery, "Stateless recovery", n, 4)
+        wrapper_test(test_verify_and_recover, "Verify and recover", n, iterations)
+        wrapper_test(test_compact_recoverable, "Compact recoverable", n, iterations)
+        wrapper_test(test_entropy_pool, "Entropy pool", n, iterations)
+        wrapper_test(test_keystore, "Keystore", n, iterations)
+        wrapper_test(test_lazy_expansion, "Lazy expansion", n, iterations)
+        wrapper_test(test_verify_batch, "Verify batch", n, iterations)
+        wrapper_test(test_verify_batch_multikey, "Verify multikey", n, iterations)
         # wrapper_test(test_sign_KAT, "Signature KATs", n, iterations)
     print("")
 
@@ -308,6 +912,8 @@ if (__name__ == "__main__"):
 
     # wrapper_test(test_samplerz_simple, "SamplerZ", None, 100000)
     wrapper_test(test_samplerz_KAT, "SamplerZ KATs", None, 1)
+    wrapper_test(test_samplerz_batch_simple, "SamplerZ batch", None, 100000)
+    wrapper_test(test_chacha20, "ChaCha20", None, 10)
     print("")
 
     for i in range(6, 11):